@@ -3,20 +3,24 @@
 # This script creates a fully functional FastAPI web server that acts as a
 # front-end for the document processing pipeline. It exposes an endpoint
 # to upload multiple documents of various types, intelligently routing them
-# through the appropriate processing path as background tasks.
+# through the appropriate processing path as durable Celery tasks.
 
 import os
-import shutil
+import asyncio
+import base64
 import logging
 import uuid
+
+import aiofiles
+from celery.result import AsyncResult
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, status
+from prometheus_fastapi_instrumentator import Instrumentator
 from typing import Dict, Any, List
 
-# --- Direct imports of the core processing functions from our pipeline scripts ---
-from stage_1_processing import process_single_pdf
-from stage_2_processing import initialize_llm, process_single_document
-from stage_3_processing import initialize_markitdown_client, process_single_markdown_file
+# --- Pipeline tasks live in tasks.py and execute on Celery workers ---
+from tasks import celery_app, process_pdf_pipeline_task, process_text_pipeline_task
+from task_store import store as task_store
 
 # --- Centralized Pipeline Configuration ---
 BASE_DIR = Path(__file__).resolve().parent
@@ -37,134 +41,187 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# --- Initialize API Clients (Singleton Pattern) ---
-logging.info("Initializing API clients...")
-llm_client = initialize_llm()
-md_client = initialize_markitdown_client()
-if not llm_client or not md_client:
-    logging.error("FATAL: Could not initialize one or more Azure API clients. Check environment variables.")
-    logging.error("The API will run, but processing endpoints will be unavailable.")
+# Uploads below this size are coalesced into batched writes instead of
+# getting their own open/write/close cycle.
+SMALL_UPLOAD_THRESHOLD = 1 << 20  # 1 MiB
+
+
+class BatchingUploadWriter:
+    """
+    Coalesces small upload writes into batched disk flushes.
+
+    A burst of small .txt/.md uploads would otherwise issue one
+    open/write/close sequence per file, pegging SSD queue depth with tiny
+    sync'd writes. Writers enqueue (path, bytes) pairs; a background drain
+    task collects up to max_batch entries (or whatever arrives within
+    max_wait seconds) and writes them in a single executor job.
+    """
+
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.05):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._drain_task = None
+
+    def start(self):
+        """Starts the background drain task (idempotent)."""
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain())
+
+    async def write(self, path: Path, data: bytes):
+        """Enqueues one small file and waits until its batch hits disk."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((path, data, future))
+        await future
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            errors = await loop.run_in_executor(None, self._write_batch, batch)
+            for (_, _, future), error in zip(batch, errors):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+    @staticmethod
+    def _write_batch(batch):
+        errors = []
+        for path, data, _ in batch:
+            try:
+                with open(path, "wb") as f:
+                    f.write(data)
+                errors.append(None)
+            except OSError as e:
+                errors.append(e)
+        return errors
+
+
+upload_writer = BatchingUploadWriter()
 
 # --- FastAPI Application ---
 app = FastAPI(
     title="Document Processing Pipeline API",
     description="An API to process documents through a multi-stage AI pipeline.",
-    version="1.2.0"
+    version="1.3.0"
 )
 
-# --- Background Task Definitions ---
-
-def process_pdf_pipeline_task(temp_pdf_path: str, base_filename: str):
-    """Background task for the full 3-stage PDF processing pipeline."""
-    logging.info(f"PDF PIPELINE STARTING for document: {base_filename}")
-    try:
-        # Stage 1: Local OCR and Asset Extraction
-        s1_result = process_single_pdf(str(temp_pdf_path), str(STAGE1_MD_DIR), str(STAGE1_ASSET_DIR))
-        if s1_result["status"] != "success":
-            raise RuntimeError(f"Stage 1 failed: {s1_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 1 SUCCESS for {base_filename}")
-
-        # Stage 2: LLM Vision Analysis and Cleanup
-        s1_md_path = STAGE1_MD_DIR / f"{base_filename}.md"
-        s1_asset_dir = STAGE1_ASSET_DIR / base_filename
-        s2_result = process_single_document(llm_client, str(s1_md_path), str(s1_asset_dir), str(STAGE2_MD_DIR))
-        if s2_result["status"] != "success":
-            raise RuntimeError(f"Stage 2 failed: {s2_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 2 SUCCESS for {base_filename}")
-
-        # Stage 3: Final Document Synthesis
-        s2_md_path = STAGE2_MD_DIR / f"{base_filename}.md"
-        s3_result = process_single_markdown_file(md_client, str(s2_md_path), str(STAGE3_OUTPUT_DIR))
-        if s3_result["status"] != "success":
-            raise RuntimeError(f"Stage 3 failed: {s3_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 3 SUCCESS for {base_filename}")
-        
-    except Exception as e:
-        logging.error(f"PDF PIPELINE FAILED for {base_filename}: {e}", exc_info=True)
-    finally:
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
-            logging.info(f"Cleaned up temporary file: {temp_pdf_path}")
-
-def process_text_pipeline_task(temp_doc_path: str, base_filename: str):
-    """Background task for the 'fast path' text-based document processing."""
-    logging.info(f"TEXT PIPELINE STARTING for document: {base_filename}")
-    try:
-        # For text files, we bypass Stages 1 and 2.
-        # MarkItDown's `convert` method can take the file path directly.
-        # This is a simplified version of our Stage 3 logic.
-        logging.info(f"Bypassing Stage 1 & 2 for text file: {base_filename}")
-        
-        # We can reuse the Stage 3 processor, but might use a different prompt
-        # in a future version. For now, the standard one is fine.
-        s3_result = process_single_markdown_file(md_client, str(temp_doc_path), str(STAGE3_OUTPUT_DIR))
-        
-        if s3_result["status"] != "success":
-             raise RuntimeError(f"Stage 3 (fast path) failed: {s3_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 3 (fast path) SUCCESS for {base_filename}")
-
-    except Exception as e:
-        logging.error(f"TEXT PIPELINE FAILED for {base_filename}: {e}", exc_info=True)
-    finally:
-        if os.path.exists(temp_doc_path):
-            os.remove(temp_doc_path)
-            logging.info(f"Cleaned up temporary file: {temp_doc_path}")
+# Expose request metrics on /metrics. The cache hit/miss counters live in the
+# Celery worker processes and are scraped from their own exporters (tasks.py).
+Instrumentator().instrument(app).expose(app)
+
+
+@app.on_event("startup")
+async def start_upload_writer():
+    upload_writer.start()
+
+
+# Bounds concurrent upload saves so a large batch cannot exhaust open FDs.
+save_semaphore = asyncio.Semaphore(16)
+
+
+async def _save_and_route(file: UploadFile) -> Dict[str, Any]:
+    """Saves (or inlines) a single upload and queues the right pipeline task."""
+    file_extension = Path(file.filename).suffix.lower()
+    original_base_filename = os.path.splitext(file.filename)[0]
+
+    # Use a unique ID to prevent filename collisions
+    unique_id = str(uuid.uuid4())
+    unique_filename = f"{original_base_filename}_{unique_id}{file_extension}"
+    temp_doc_path = UPLOAD_DIR / unique_filename
+
+    async with save_semaphore:
+        try:
+            # --- Content-Aware Routing ---
+            head = await file.read(SMALL_UPLOAD_THRESHOLD + 1)
+            is_small = len(head) <= SMALL_UPLOAD_THRESHOLD
+
+            if file_extension in [".txt", ".md"] and is_small:
+                # Small text payloads skip the temp-file round-trip entirely:
+                # the bytes travel inline in the task message and are spilled
+                # to disk by the worker that processes them.
+                logging.info(f"Routing '{file.filename}' to Text pipeline (in-memory fast path).")
+                task = process_text_pipeline_task.delay(
+                    None, original_base_filename,
+                    content_b64=base64.b64encode(head).decode("ascii"),
+                    suffix=file_extension,
+                )
+                return {"filename": file.filename, "task_id": task.id, "status": "accepted_for_text_pipeline"}
+
+            elif file_extension in [".pdf", ".txt", ".md", ".docx"]:
+                # Everything else is saved first. Small binary files are
+                # coalesced through the batching writer; large files stream to
+                # disk asynchronously so the event loop never blocks.
+                if file_extension != ".pdf" and is_small:
+                    await upload_writer.write(temp_doc_path, head)
+                else:
+                    async with aiofiles.open(temp_doc_path, "wb") as buffer:
+                        await buffer.write(head)
+                        while chunk := await file.read(1 << 20):  # 1 MiB chunks
+                            await buffer.write(chunk)
+                        # Drop the upload's bytes from the page cache so large
+                        # uploads don't evict data the pipeline stages are
+                        # actively reusing. (No-op without posix_fadvise.)
+                        await buffer.flush()
+                        if hasattr(os, "posix_fadvise"):
+                            # fileno() is delegated synchronously by aiofiles,
+                            # so it must not be awaited.
+                            os.posix_fadvise(buffer.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+                if file_extension == ".pdf":
+                    logging.info(f"Routing '{file.filename}' to PDF pipeline.")
+                    task = process_pdf_pipeline_task.delay(str(temp_doc_path), original_base_filename)
+                    return {"filename": file.filename, "task_id": task.id, "status": "accepted_for_pdf_pipeline"}
+                else:
+                    logging.info(f"Routing '{file.filename}' to Text pipeline (fast path).")
+                    task = process_text_pipeline_task.delay(str(temp_doc_path), original_base_filename)
+                    return {"filename": file.filename, "task_id": task.id, "status": "accepted_for_text_pipeline"}
+
+            else:
+                return {"filename": file.filename, "task_id": None, "status": "rejected", "detail": f"Unsupported file type: '{file_extension}'"}
+
+        except Exception as e:
+            return {"filename": file.filename, "task_id": None, "status": "error", "detail": f"Failed to save uploaded file: {e}"}
+        finally:
+            await file.close()
 
 
 @app.post("/process", status_code=status.HTTP_202_ACCEPTED)
 async def create_upload_files(
-    files: List[UploadFile] = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    files: List[UploadFile] = File(...)
 ) -> Dict[str, Any]:
     """
     Endpoint to upload one or more documents and trigger the appropriate
-    processing pipeline for each.
+    processing pipeline for each. Files are saved and routed concurrently;
+    each accepted file is queued as a durable Celery task whose task_id can
+    be polled via /status/{task_id}.
     """
-    if not llm_client or not md_client:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="API clients are not initialized. Check server logs and environment variables."
-        )
-
-    processed_files = []
+    named_files = []
     for file in files:
         if not file.filename:
             logging.warning("Skipping a file with no filename.")
-            continue
-        
-        file_extension = Path(file.filename).suffix.lower()
-        original_base_filename = os.path.splitext(file.filename)[0]
-        
-        # Use a unique ID to prevent filename collisions
-        unique_id = str(uuid.uuid4())
-        unique_filename = f"{original_base_filename}_{unique_id}{file_extension}"
-        temp_doc_path = UPLOAD_DIR / unique_filename
-
-        try:
-            # Save the file temporarily
-            with open(temp_doc_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # --- Content-Aware Routing ---
-            if file_extension == ".pdf":
-                logging.info(f"Routing '{file.filename}' to PDF pipeline.")
-                background_tasks.add_task(process_pdf_pipeline_task, str(temp_doc_path), original_base_filename)
-                processed_files.append({"filename": file.filename, "task_id": unique_id, "status": "accepted_for_pdf_pipeline"})
-            
-            elif file_extension in [".txt", ".md", ".docx"]:
-                 logging.info(f"Routing '{file.filename}' to Text pipeline (fast path).")
-                 # NOTE: Markitdown needs the file path, so we still save it.
-                 background_tasks.add_task(process_text_pipeline_task, str(temp_doc_path), original_base_filename)
-                 processed_files.append({"filename": file.filename, "task_id": unique_id, "status": "accepted_for_text_pipeline"})
-            
-            else:
-                os.remove(temp_doc_path) # Clean up unsupported file
-                processed_files.append({"filename": file.filename, "task_id": None, "status": "rejected", "detail": f"Unsupported file type: '{file_extension}'"})
+        else:
+            named_files.append(file)
 
-        except Exception as e:
-            processed_files.append({"filename": file.filename, "task_id": None, "status": "error", "detail": f"Failed to save uploaded file: {e}"})
-        finally:
-            file.file.close()
+    results = await asyncio.gather(
+        *(_save_and_route(f) for f in named_files), return_exceptions=True
+    )
+    processed_files = []
+    for file, result in zip(named_files, results):
+        if isinstance(result, BaseException):
+            processed_files.append({"filename": file.filename, "task_id": None, "status": "error", "detail": str(result)})
+        else:
+            processed_files.append(result)
 
     if not processed_files:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No valid files were provided for processing.")
@@ -174,8 +231,24 @@ async def create_upload_files(
         "results": processed_files
     }
 
+@app.get("/status/{task_id}")
+def read_task_status(task_id: str) -> Dict[str, Any]:
+    """Returns the Celery state (and error, if any) for a queued pipeline task."""
+    result = AsyncResult(task_id, app=celery_app)
+    response = {"task_id": task_id, "state": result.state}
+    if result.failed():
+        response["error"] = str(result.result)
+    return response
+
+@app.get("/tasks/{task_id}")
+def read_task_progress(task_id: str) -> Dict[str, Any]:
+    """Returns structured per-stage progress recorded by the pipeline workers."""
+    state = task_store.get(task_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No recorded progress for task '{task_id}'.")
+    return {"task_id": task_id, **state}
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Document Processing Pipeline API. Navigate to /docs for the API documentation."}
-
-
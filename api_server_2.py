@@ -3,21 +3,22 @@
 # This script creates a fully functional FastAPI web server that acts as a
 # front-end for the document processing pipeline. It exposes an endpoint
 # to upload a PDF, which then triggers the full 3-stage pipeline as a
-# background task using the actual, imported processing functions.
+# durable Celery task executed on dedicated worker processes.
 
 import os
-import shutil
 import logging
 import uuid
+
+import aiofiles
+from celery.result import AsyncResult
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from prometheus_fastapi_instrumentator import Instrumentator
 from typing import Dict, Any
 
-# --- Direct imports of the core processing functions from our pipeline scripts ---
-# These are the actual workhorses of the pipeline.
-from stage_1_processing import process_single_pdf
-from stage_2_processing import initialize_llm, process_single_document
-from stage_3_processing import initialize_markitdown_client, process_single_markdown_file
+# --- Pipeline tasks live in tasks.py and execute on Celery workers ---
+from tasks import celery_app, process_pdf_pipeline_task
+from task_store import store as task_store
 
 # --- Centralized Pipeline Configuration ---
 # All directory paths are managed here, providing a single source of truth.
@@ -39,88 +40,28 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# --- Initialize API Clients (Singleton Pattern) ---
-# Clients are initialized once when the application starts to avoid
-# the overhead of re-authentication on every request.
-logging.info("Initializing API clients...")
-llm_client = initialize_llm()
-md_client = initialize_markitdown_client()
-if not llm_client or not md_client:
-    logging.error("FATAL: Could not initialize Azure API clients. Check environment variables. Server will not be fully functional.")
-    # In a production scenario, you might want to exit here if clients are essential.
-    # For now, we'll allow the server to run but processing will fail.
-logging.info("API clients initialized successfully.")
-
-
 # --- FastAPI Application ---
 app = FastAPI(
     title="Document Processing Pipeline API",
     description="An API to process scanned PDF documents through a 3-stage AI pipeline.",
-    version="1.0.0"
+    version="1.1.0"
 )
 
+# Expose request metrics on /metrics. The cache hit/miss counters live in the
+# Celery worker processes and are scraped from their own exporters (tasks.py).
+Instrumentator().instrument(app).expose(app)
 
-def process_pipeline_task(temp_pdf_path: str, base_filename: str):
-    """
-    The main background task that runs the entire pipeline sequentially on a single file.
-    """
-    logging.info(f"PIPELINE STARTING for document: {base_filename}")
-    try:
-        # --- Stage 1: Local OCR and Asset Extraction ---
-        stage1_result = process_single_pdf(
-            pdf_path=str(temp_pdf_path),
-            md_dir=str(STAGE1_MD_DIR),
-            asset_dir=str(STAGE1_ASSET_DIR)
-        )
-        if stage1_result["status"] != "success":
-            raise RuntimeError(f"Stage 1 failed: {stage1_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 1 SUCCESS for {base_filename}")
-
-        # --- Stage 2: LLM Vision Analysis and Cleanup ---
-        stage1_md_path = STAGE1_MD_DIR / f"{base_filename}.md"
-        stage1_doc_asset_dir = STAGE1_ASSET_DIR / base_filename
-        stage2_result = process_single_document(
-            llm=llm_client,
-            md_path=str(stage1_md_path),
-            asset_dir=str(stage1_doc_asset_dir),
-            output_dir=str(STAGE2_MD_DIR)
-        )
-        if stage2_result["status"] != "success":
-            raise RuntimeError(f"Stage 2 failed: {stage2_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 2 SUCCESS for {base_filename}")
-
-        # --- Stage 3: Final Document Synthesis ---
-        stage2_md_path = STAGE2_MD_DIR / f"{base_filename}.md"
-        stage3_result = process_single_markdown_file(
-            md_client=md_client,
-            md_path=str(stage2_md_path),
-            output_dir=str(STAGE3_OUTPUT_DIR)
-        )
-        if stage3_result["status"] != "success":
-            raise RuntimeError(f"Stage 3 failed: {stage3_result.get('error', 'Unknown error')}")
-        logging.info(f"Stage 3 SUCCESS for {base_filename}")
-        
-        logging.info(f"PIPELINE COMPLETE for document: {base_filename}")
-
-    except Exception as e:
-        logging.error(f"PIPELINE FAILED for {base_filename}: {e}", exc_info=True)
-    finally:
-        # Clean up the uploaded file after processing is complete, regardless of success
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
-            logging.info(f"Cleaned up temporary file: {temp_pdf_path}")
 
 @app.post("/process", status_code=202)
 async def create_upload_file(
-    file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    file: UploadFile = File(...)
 ) -> Dict[str, Any]:
     """
     Endpoint to upload a PDF and trigger the processing pipeline.
 
     This endpoint accepts a PDF file, saves it temporarily with a unique name
-    to avoid collisions, and starts the full 3-stage processing pipeline
-    as a background task. It returns an immediate response to the client.
+    to avoid collisions, and queues the full 3-stage processing pipeline
+    as a durable Celery task. It returns an immediate response to the client.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided.")
@@ -134,30 +75,56 @@ async def create_upload_file(
     unique_filename = f"{original_base_filename}_{unique_id}.pdf"
     temp_pdf_path = UPLOAD_DIR / unique_filename
 
-    # Save the uploaded file to a temporary location
+    # Save the uploaded file to a temporary location. The write is fully async
+    # so the event loop can interleave other requests while the upload streams in.
     try:
-        with open(temp_pdf_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        async with aiofiles.open(temp_pdf_path, "wb") as buffer:
+            while chunk := await file.read(1 << 20):  # 1 MiB chunks
+                await buffer.write(chunk)
+            # Drop the upload's bytes from the page cache so large uploads
+            # don't evict data the pipeline stages are actively reusing.
+            # (No-op on platforms without posix_fadvise, e.g. macOS.)
+            await buffer.flush()
+            if hasattr(os, "posix_fadvise"):
+                # fileno() is delegated synchronously by aiofiles, so it must
+                # not be awaited.
+                os.posix_fadvise(buffer.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save uploaded file: {e}")
     finally:
-        file.file.close()
+        await file.close()
 
-    logging.info(f"Received file '{file.filename}'. Starting pipeline in background for task ID: {unique_id}")
+    logging.info(f"Received file '{file.filename}'. Queuing pipeline task.")
 
-    # Add the long-running job to the background tasks
+    # Queue the long-running job on the Celery workers.
     # The base filename for output artifacts will not have the unique ID
-    background_tasks.add_task(process_pipeline_task, str(temp_pdf_path), original_base_filename)
+    task = process_pdf_pipeline_task.delay(str(temp_pdf_path), original_base_filename)
 
     return {
-        "message": "File accepted. Processing has started in the background.",
+        "message": "File accepted. Processing has been queued.",
         "original_filename": file.filename,
-        "task_id": unique_id,
-        "status_info": "The pipeline will run asynchronously. Check server logs for progress."
+        "task_id": task.id,
+        "status_info": "Poll /status/{task_id} for progress."
     }
 
+@app.get("/status/{task_id}")
+def read_task_status(task_id: str) -> Dict[str, Any]:
+    """Returns the Celery state (and error, if any) for a queued pipeline task."""
+    result = AsyncResult(task_id, app=celery_app)
+    response = {"task_id": task_id, "state": result.state}
+    if result.failed():
+        response["error"] = str(result.result)
+    return response
+
+@app.get("/tasks/{task_id}")
+def read_task_progress(task_id: str) -> Dict[str, Any]:
+    """Returns structured per-stage progress recorded by the pipeline workers."""
+    state = task_store.get(task_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No recorded progress for task '{task_id}'.")
+    return {"task_id": task_id, **state}
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Document Processing Pipeline API. Navigate to /docs for the API documentation."}
-
-
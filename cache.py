@@ -0,0 +1,108 @@
+# cache.py
+#
+# A small content-addressed cache for expensive LLM pipeline stages, backed
+# by Redis. Stage outputs are keyed on the SHA-256 of the stage input plus a
+# version tag (prompt/model revision), so re-ingesting an unchanged document
+# short-circuits straight to the cached output instead of paying for another
+# round of LLM calls.
+
+import os
+import hashlib
+import logging
+import mmap
+from typing import Optional
+
+import redis
+from prometheus_client import Counter
+
+# BLAKE3 is SIMD-accelerated and several times faster than SHA-256 for the
+# multi-megabyte inputs hashed here; fall back to SHA-256 when the optional
+# wheel is not installed. Cache keys embed the digest either way, so a
+# changed algorithm only causes one round of cold misses, never stale hits.
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+
+# Cached entries expire after 7 days; re-ingestion beyond that window is rare
+# enough that paying for a fresh synthesis is acceptable.
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Hit/miss counters make the cache's dollar savings observable per environment.
+# They increment inside the Celery worker processes, so they are scraped from
+# the per-worker exporters started in tasks.py (WORKER_METRICS_BASE_PORT and
+# up), not from the API servers' /metrics endpoint.
+CACHE_HITS = Counter("llm_cache_hits_total", "LLM stage-cache hits")
+CACHE_MISSES = Counter("llm_cache_misses_total", "LLM stage-cache misses")
+
+_redis_client = None
+
+
+def _get_client() -> Optional[redis.Redis]:
+    """Lazily connects to Redis; returns None if the server is unreachable."""
+    global _redis_client
+    if _redis_client is None:
+        try:
+            _redis_client = redis.Redis.from_url(
+                os.getenv("PIPELINE_CACHE_URL", "redis://localhost:6379/2")
+            )
+            _redis_client.ping()
+            # Bound the cache tier's memory: with every key carrying a TTL,
+            # LRU eviction of expiring keys keeps growth capped under load.
+            try:
+                _redis_client.config_set("maxmemory-policy", "volatile-lru")
+            except redis.RedisError:
+                logging.info("Could not set Redis eviction policy (managed instance?); relying on TTLs only.")
+        except Exception as e:
+            logging.warning(f"Stage cache unavailable, proceeding without it: {e}")
+            _redis_client = None
+            return None
+    return _redis_client
+
+
+def hash_file(path: str) -> str:
+    """Returns the content hash of a file (BLAKE3 if available, else SHA-256).
+
+    The file is memory-mapped so the hash runs over the page cache directly
+    instead of copying through 1 MiB read() buffers.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses zero-length files.
+            data = b""
+            return (blake3.blake3(data) if BLAKE3_AVAILABLE
+                    else hashlib.sha256(data)).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if BLAKE3_AVAILABLE:
+                return blake3.blake3(mm, max_threads=blake3.blake3.AUTO).hexdigest()
+            return hashlib.sha256(mm).hexdigest()
+
+
+def check(input_hash: str, version: str) -> Optional[bytes]:
+    """Returns the cached stage output for (input_hash, version), or None."""
+    client = _get_client()
+    if not client:
+        CACHE_MISSES.inc()
+        return None
+    try:
+        value = client.get(f"stage-cache:{version}:{input_hash}")
+    except Exception as e:
+        logging.warning(f"Stage cache read failed: {e}")
+        value = None
+    if value is not None:
+        CACHE_HITS.inc()
+    else:
+        CACHE_MISSES.inc()
+    return value
+
+
+def save(input_hash: str, version: str, output_bytes: bytes) -> None:
+    """Stores a stage output under (input_hash, version) with a TTL."""
+    client = _get_client()
+    if not client:
+        return
+    try:
+        client.set(f"stage-cache:{version}:{input_hash}", output_bytes, ex=CACHE_TTL_SECONDS)
+    except Exception as e:
+        logging.warning(f"Stage cache write failed: {e}")
@@ -0,0 +1,104 @@
+# conftest.py
+#
+# Shared pytest fixtures for the document processing pipeline test suite.
+# Fixtures defined here are visible to every test file in the project root.
+
+import fcntl
+import hashlib
+import inspect
+import io
+import os
+import shutil
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+from PIL import Image
+
+import create_test_data
+# Imported here (not just in the test modules) so @pytest.mark.forked Stage 1
+# tests fork from a parent that already paid the PyMuPDF/pytesseract import
+# cost; the child inherits the loaded modules via copy-on-write.
+import stage_1_processing  # noqa: F401
+
+# The synthetic corpus every test file shares; keep in sync with the
+# creator functions in create_test_data.py.
+CORPUS_CREATORS = {
+    "text_only.pdf": create_test_data.create_text_only_pdf,
+    "image_heavy.pdf": create_test_data.create_image_heavy_pdf,
+    "mixed_content.pdf": create_test_data.create_mixed_content_pdf,
+    "difficult_scan.pdf": create_test_data.create_difficult_scan_pdf,
+    "corrupted.pdf": create_test_data.create_corrupted_pdf,
+}
+
+
+@pytest.fixture(scope="session")
+def pdf_corpus(request, tmp_path_factory):
+    """
+    Provides the synthetic PDF corpus directory for Stage 1 integration tests.
+
+    Only those tests should request this fixture — the Stage 2/3 unit tests
+    work on a single dummy PNG or markdown file and must not pay for PDF
+    generation. The corpus is generated at most once per working copy: it
+    is cached under pytest's cache_dir keyed on a hash of the generator's
+    source, so warm runs just copy the PDFs instead of rebuilding them. The
+    key changes whenever create_test_data.py changes, so a stale corpus is
+    never reused. Nothing chdirs, so xdist workers and the developer's
+    shell CWD are left untouched.
+    """
+    env_dir = tmp_path_factory.mktemp("pipeline")
+    test_data_dir = env_dir / "test_data"
+
+    corpus_hash = hashlib.sha1(inspect.getsource(create_test_data).encode()).hexdigest()
+    cache_dir = request.config.cache.mkdir(f"corpus_{corpus_hash}")
+
+    # The cache dir is shared by every xdist worker and this fixture runs
+    # once per worker, so regeneration and the copy out of the cache are
+    # serialized behind an exclusive flock: without it, workers racing on a
+    # cold cache could interleave writes and persist corrupted PDFs. The
+    # staleness check happens under the lock so late arrivals see the files
+    # the first worker just finished.
+    with open(cache_dir / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        # Regenerate only stale entries: one stat per file skips any creator
+        # whose cached output already exists and postdates the generator
+        # module itself. The hash key above catches source edits between
+        # runs; this guard additionally rescues a partially populated cache
+        # dir without rebuilding the files that did land.
+        creator_mtime = os.path.getmtime(create_test_data.__file__)
+        stale = [(function, cache_dir / filename)
+                 for filename, function in CORPUS_CREATORS.items()
+                 if not ((cache_dir / filename).exists()
+                         and os.path.getmtime(cache_dir / filename) >= creator_mtime)]
+        if stale:
+            # The creators each write a distinct file and are CPU-bound (PIL
+            # render + PDF encode), so they run in parallel worker processes
+            # through the same picklable helper the generator's CLI uses.
+            # Each file is generated under a temp name and renamed into
+            # place, so a cached entry is only ever observed complete.
+            # Suppress print statements from the generator for cleaner output.
+            functions, final_paths = zip(*stale)
+            temp_paths = [f"{path}.tmp{os.getpid()}" for path in final_paths]
+            with patch('builtins.print'):
+                with ProcessPoolExecutor(max_workers=len(stale)) as executor:
+                    list(executor.map(create_test_data._generate_one, functions, temp_paths))
+            for temp_path, final_path in zip(temp_paths, final_paths):
+                os.replace(temp_path, final_path)
+
+        shutil.copytree(cache_dir, test_data_dir,
+                        ignore=shutil.ignore_patterns(".lock", "*.tmp*"))
+
+    yield test_data_dir
+
+
+@pytest.fixture(scope="session")
+def dummy_png_bytes():
+    """
+    A 10x10 RGB image encoded as PNG, rendered once per session.
+
+    Tests that need a throwaway image on disk write these bytes straight to
+    their target path instead of re-running Pillow's render/encode per test.
+    """
+    buf = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buf, 'PNG')
+    return buf.getvalue()
@@ -1,5 +1,6 @@
 import os
-import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from markitdown import MarkItDown
 
 # --- CONFIGURATION ---
@@ -8,15 +9,52 @@ from markitdown import MarkItDown
 INPUT_FOLDER = '.'
 OUTPUT_FOLDER = 'markdown_output'
 
+# Cap the worker count: beyond this, concurrent Azure calls just trip rate limits.
+MAX_WORKERS = 16
+
 # Define the prompt for the image analysis model.
-LLM_PROMPT = """Analyze the provided image, which may be a diagram, chart, or screenshot 
-from a computer science context. Your analysis must be returned as a Markdown blockquote. 
-Inside the blockquote, provide a concise, one-sentence summary of the image's purpose. 
-Following the summary, create a bulleted list detailing key components, data points, or 
-relationships shown in the image. The tone should be technical and precise, suitable for an 
+LLM_PROMPT = """Analyze the provided image, which may be a diagram, chart, or screenshot
+from a computer science context. Your analysis must be returned as a Markdown blockquote.
+Inside the blockquote, provide a concise, one-sentence summary of the image's purpose.
+Following the summary, create a bulleted list detailing key components, data points, or
+relationships shown in the image. The tone should be technical and precise, suitable for an
 engineering document."""
 
 # --- SCRIPT LOGIC ---
+
+# One MarkItDown client per worker process, created lazily on first use.
+_worker_md = None
+
+def _get_worker_client():
+    global _worker_md
+    if _worker_md is None:
+        _worker_md = MarkItDown(
+            docintel_endpoint=os.environ.get("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"),
+            llm_client_class="azure_openai",
+            llm_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+            llm_model="gpt-4o",
+            llm_prompt=LLM_PROMPT
+        )
+    return _worker_md
+
+def convert_one(pdf_path):
+    """Converts a single PDF to Markdown. Runs inside a worker process."""
+    md = _get_worker_client()
+
+    # This is where the conversion happens
+    result = md.convert(pdf_path)
+
+    # Create the output filename
+    base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_path = os.path.join(OUTPUT_FOLDER, f"{base_filename}.md")
+
+    # Save the result to a new Markdown file. The 1 MiB buffer batches the
+    # write into large blocks instead of one syscall per stdio buffer.
+    with open(output_path, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        f.write(result.text_content)
+
+    return output_path
+
 def main():
     docintel_endpoint = os.environ.get("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
     openai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
@@ -26,43 +64,30 @@ def main():
         print("Please run the 'export' commands for your endpoints and keys before running this script.")
         return
 
-    md = MarkItDown(
-        docintel_endpoint=docintel_endpoint,
-        llm_client_class="azure_openai",
-        llm_endpoint=openai_endpoint,
-        llm_model="gpt-4o",
-        llm_prompt=LLM_PROMPT
-    )
-
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
     print(f"Output will be saved to '{OUTPUT_FOLDER}' directory.")
 
-    pdf_files = glob.glob(os.path.join(INPUT_FOLDER, '*.pdf'))
+    # os.scandir enumerates the directory in a single getdents walk without
+    # the extra fnmatch/stat work glob.glob does per entry.
+    with os.scandir(INPUT_FOLDER) as entries:
+        pdf_files = [e.path for e in entries if e.is_file() and e.name.lower().endswith('.pdf')]
     if not pdf_files:
         print(f"No PDF files found in '{INPUT_FOLDER}'.")
         return
 
     print(f"Found {len(pdf_files)} PDF(s) to process. Starting conversion...")
 
-    for pdf_path in pdf_files:
-        try:
-            print(f"Processing '{os.path.basename(pdf_path)}'...")
-            
-            # This is where the conversion happens
-            result = md.convert(pdf_path)
-            
-            # Create the output filename
-            base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
-            output_path = os.path.join(OUTPUT_FOLDER, f"{base_filename}.md")
-            
-            # Save the result to a new Markdown file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(result.text_content)
-                
-            print(f" -> Successfully converted and saved to '{output_path}'")
-
-        except Exception as e:
-            print(f" -> FAILED to convert '{os.path.basename(pdf_path)}'. Error: {e}")
+    # Fan the corpus out across worker processes so Azure API latency
+    # overlaps instead of serializing end-to-end.
+    with ProcessPoolExecutor(max_workers=min(MAX_WORKERS, len(pdf_files))) as executor:
+        futures = {executor.submit(convert_one, p): p for p in pdf_files}
+        for future in as_completed(futures):
+            pdf_path = futures[future]
+            try:
+                output_path = future.result()
+                print(f" -> Successfully converted '{os.path.basename(pdf_path)}' and saved to '{output_path}'")
+            except Exception as e:
+                print(f" -> FAILED to convert '{os.path.basename(pdf_path)}'. Error: {e}")
 
     print("\nConversion process complete.")
 
@@ -5,8 +5,13 @@
 # scenarios as outlined in TESTING.md.
 
 import os
+from functools import lru_cache
+from multiprocessing import Pool
 from fpdf import FPDF
 from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 import io
 
 # --- Configuration ---
@@ -21,6 +26,16 @@ LOREM_IPSUM = (
 
 # --- Helper Functions ---
 
+@lru_cache(maxsize=32)
+def _get_font(font_name: str, size: int):
+    """Loads a font once per (name, size); FreeType parsing is not free when
+    helpers are extended to render many pages."""
+    try:
+        # Use a common system font, fallback to default if not found
+        return ImageFont.truetype(font_name, size)
+    except IOError:
+        return ImageFont.load_default()
+
 def create_text_only_pdf(path: str):
     """Creates a simple, multi-page, text-only PDF."""
     pdf = FPDF()
@@ -41,50 +56,50 @@ def create_text_only_pdf(path: str):
 
 def create_image_heavy_pdf(path: str):
     """Creates a PDF with full-page images."""
-    pdf = FPDF()
+    c = canvas.Canvas(path, pagesize=A4)
+    page_width, page_height = A4
     for i in range(2):
         img = Image.new('RGB', (600, 800), color=f'rgb(100, 150, 20{i*20})')
         draw = ImageDraw.Draw(img)
         draw.text((100, 400), f"This is image {i+1}", fill='white')
-        
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        pdf.add_page()
-        # Use FPDF's image handling from a stream
-        pdf.image(img_byte_arr, x=10, y=8, w=190)
-    pdf.output(path)
+
+        # ImageReader accepts the PIL object directly, so the image goes
+        # straight into the PDF without a PNG encode/decode round-trip.
+        c.drawImage(ImageReader(img), 30, 60, width=page_width - 60, height=page_height - 120)
+        c.showPage()
+    c.save()
 
 def create_mixed_content_pdf(path: str):
     """Creates a PDF with a mix of text, an image, and a table-like structure."""
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Helvetica", size=12)
-    pdf.cell(0, 10, "Test Document: Mixed Content", ln=True, align='C')
-    pdf.ln(10)
-    pdf.multi_cell(0, 5, LOREM_IPSUM)
-    
-    # Add an image
+    c = canvas.Canvas(path, pagesize=A4)
+    page_width, page_height = A4
+    c.setFont("Helvetica", 12)
+    c.drawCentredString(page_width / 2, page_height - 50, "Test Document: Mixed Content")
+
+    body = c.beginText(40, page_height - 80)
+    body.setFont("Helvetica", 12)
+    for start in range(0, len(LOREM_IPSUM), 90):
+        body.textLine(LOREM_IPSUM[start:start + 90])
+    c.drawText(body)
+
+    # Add an image (handed to reportlab as a PIL object, no PNG round-trip)
     img = Image.new('RGB', (400, 200), color='gray')
     draw = ImageDraw.Draw(img)
     draw.rectangle([10, 10, 390, 190], outline="black", width=2)
     draw.text((150, 90), "A Sample Diagram", fill='black')
-    
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-    pdf.image(img_byte_arr, x=50, y=pdf.get_y(), w=100)
-    pdf.ln(70) # Move below image
+    c.drawImage(ImageReader(img), 150, page_height - 400, width=280, height=140)
 
     # Add a simple table-like structure
-    pdf.set_font("Courier", size=10)
-    pdf.cell(0, 10, "PIN | VALUE | DESCRIPTION", ln=True)
-    pdf.cell(0, 5, "--------------------------------", ln=True)
-    pdf.cell(0, 5, " 1  | 0xFF00| DATA_BUS_0", ln=True)
-    pdf.cell(0, 5, " 2  | 0xFF01| DATA_BUS_1", ln=True)
-    
-    pdf.output(path)
+    table = c.beginText(40, page_height - 450)
+    table.setFont("Courier", 10)
+    table.textLine("PIN | VALUE | DESCRIPTION")
+    table.textLine("--------------------------------")
+    table.textLine(" 1  | 0xFF00| DATA_BUS_0")
+    table.textLine(" 2  | 0xFF01| DATA_BUS_1")
+    c.drawText(table)
+
+    c.showPage()
+    c.save()
 
 def create_difficult_scan_pdf(path: str):
     """Creates a PDF that simulates a low-quality scan to trigger fallback OCR."""
@@ -92,12 +107,7 @@ def create_difficult_scan_pdf(path: str):
     text = "This is a difficult scan.\nText is rendered as a low-quality JPEG.\nThis should trigger the fallback OCR in Stage 1.\n0ne l vs 1, O vs 0."
     img = Image.new('RGB', (800, 400), color='white')
     draw = ImageDraw.Draw(img)
-    try:
-        # Use a common system font, fallback to default if not found
-        font = ImageFont.truetype("Arial.ttf", 30)
-    except IOError:
-        font = ImageFont.load_default()
-    draw.text((50, 50), text, fill='black', font=font)
+    draw.text((50, 50), text, fill='black', font=_get_font("Arial.ttf", 30))
 
     # 2. Degrade the image by saving as a low-quality JPEG in memory
     jpeg_buffer = io.BytesIO()
@@ -115,11 +125,16 @@ def create_corrupted_pdf(path: str):
     with open(path, "w") as f:
         f.write("%PDF-1.4\nThis is not a real PDF file. It is intentionally corrupted.\n%%EOF")
 
+def _generate_one(function, filepath: str):
+    """Top-level worker so the (function, path) pairs stay picklable."""
+    print(f"  -> Creating '{os.path.basename(filepath)}'...")
+    function(filepath)
+
 # --- Main Execution ---
 if __name__ == "__main__":
     print(f"Generating test data in '{TEST_DATA_DIR}/'...")
     os.makedirs(TEST_DATA_DIR, exist_ok=True)
-    
+
     creators = {
         "text_only.pdf": create_text_only_pdf,
         "image_heavy.pdf": create_image_heavy_pdf,
@@ -127,11 +142,13 @@ if __name__ == "__main__":
         "difficult_scan.pdf": create_difficult_scan_pdf,
         "corrupted.pdf": create_corrupted_pdf,
     }
-    
-    for filename, function in creators.items():
-        filepath = os.path.join(TEST_DATA_DIR, filename)
-        print(f"  -> Creating '{filename}'...")
-        function(filepath)
-        
+
+    # The creators are independent and CPU-bound (PIL render + PDF encode),
+    # so generate them in parallel worker processes.
+    jobs = [(function, os.path.join(TEST_DATA_DIR, filename))
+            for filename, function in creators.items()]
+    with Pool(processes=min(len(creators), os.cpu_count() or 1)) as pool:
+        pool.starmap(_generate_one, jobs)
+
     print("Test data generation complete.")
 
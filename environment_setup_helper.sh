@@ -48,11 +48,11 @@ if [ ! -f "$REQUIREMENTS_FILE" ]; then
     exit 1
 fi
 
-echo "INFO: Synchronizing environment with '${REQUIREMENTS_FILE}'..."
+echo "INFO: Synchronizing environment with '${REQUIREMENTS_FILE}'. Setup is complete when the sync finishes."
 # 'uv pip sync' is idempotent: it ensures the environment exactly matches
 # the requirements file, adding missing packages and removing extraneous ones.
-uv pip sync "$REQUIREMENTS_FILE"
-
-echo "--- Environment setup complete. ---"
+# exec replaces this shell with uv for the terminal step, so no bash parent
+# lingers for its duration; uv's exit status becomes the script's.
+exec uv pip sync "$REQUIREMENTS_FILE"
 
 
@@ -40,7 +40,9 @@ add_to_shell_profile() {
         return
     fi
 
-    if [ -f "$shell_profile" ] && grep -q "export PATH=.*$path_to_add" "$shell_profile"; then
+    # Fixed-string match: $path_to_add contains dots and slashes that a regex
+    # would misinterpret, and grep -F skips regex compilation entirely.
+    if [ -f "$shell_profile" ] && grep -qF -- "$path_to_add" "$shell_profile"; then
         log_info "'$path_to_add' is already in the PATH in '$shell_profile'."
     else
         log_info "Adding '$path_to_add' to PATH in '$shell_profile' for future sessions."
@@ -54,8 +56,12 @@ add_to_shell_profile() {
 pre_flight_checks() {
     log_info "Running pre-flight system checks..."
     local errors=0
-    # 1. Check for Xcode Command Line Tools (essential for Homebrew builds)
-    if ! xcode-select -p &> /dev/null; then
+    # 1. Check for Xcode Command Line Tools (essential for Homebrew builds).
+    # The directory tests cover the standard install locations without
+    # forking a process; xcode-select only runs for custom developer dirs.
+    if ! { [ -d /Library/Developer/CommandLineTools/usr/bin ] \
+            || [ -d /Applications/Xcode.app ] \
+            || xcode-select -p &> /dev/null; }; then
         log_error "Xcode Command Line Tools not found. This is required to build packages."
         log_error "Please run 'xcode-select --install' in your terminal and try again."
         errors=$((errors + 1))
@@ -73,18 +79,36 @@ pre_flight_checks() {
     log_info "Pre-flight system checks passed."
 }
 
-install_brew_dependency() {
-    local package="$1"
-    log_info "Checking for Homebrew package: '$package'..."
-    if brew list "$package" &> /dev/null; then
-        log_info "'$package' is already installed."
-    else
-        log_info "'$package' not found. Attempting installation..."
-        if brew install "$package"; then
-            log_info "Successfully installed '$package'."
+install_brew_dependencies() {
+    # Every 'brew' invocation pays a Ruby VM cold start, so the installed set
+    # is snapshotted once and all missing packages go through one install.
+    local packages=("$@")
+    local installed missing=()
+    log_info "Checking for Homebrew packages: ${packages[*]}..."
+    installed=$(brew list --formula -1 2> /dev/null || true)
+    for package in "${packages[@]}"; do
+        if grep -qxF "$package" <<< "$installed"; then
+            log_info "'$package' is already installed."
         else
-            log_warning "Standard 'brew install $package' failed. This is common on older macOS versions."
-            log_warning "Attempting to force installation by building from source. This may take a while..."
+            missing+=("$package")
+        fi
+    done
+
+    if [ ${#missing[@]} -eq 0 ]; then
+        log_info "All Homebrew dependencies are already installed."
+        return
+    fi
+
+    log_info "Installing missing Homebrew packages: ${missing[*]}..."
+    if brew install "${missing[@]}"; then
+        log_info "Successfully installed: ${missing[*]}."
+    else
+        log_warning "Batched 'brew install' failed. This is common on older macOS versions."
+        log_warning "Attempting to force installation by building from source. This may take a while..."
+        for package in "${missing[@]}"; do
+            if brew list "$package" &> /dev/null; then
+                continue
+            fi
             if brew install --build-from-source "$package"; then
                 log_info "Successfully installed '$package' by building from source."
             else
@@ -92,7 +116,7 @@ install_brew_dependency() {
                 log_error "Please try to resolve the Homebrew issue manually and rerun the script."
                 exit 1
             fi
-        fi
+        done
     fi
 }
 
@@ -179,9 +203,10 @@ main() {
     pre_flight_checks
     
     log_info "Installing required system dependencies via Homebrew..."
-    install_brew_dependency "tesseract"
-    install_brew_dependency "poppler"
-    install_brew_dependency "coreutils" # For gtimeout, improves master script reliability
+    # coreutils provides gtimeout, which improves master script reliability.
+    # libjpeg-turbo gives Pillow a SIMD-accelerated JPEG codec when it is
+    # (re)built from source, e.g. for the optional pillow-simd swap.
+    install_brew_dependencies "tesseract" "poppler" "coreutils" "libjpeg-turbo"
     
     ensure_uv_installed
     create_project_structure
@@ -41,9 +41,12 @@ validate_system_dependencies() {
         missing_deps=$((missing_deps + 1))
     fi
 
-    # Check for Tesseract and Poppler
+    # Check for Tesseract and Poppler against one cached 'brew list' snapshot
+    # instead of forking brew (and its Ruby startup) once per dependency.
+    local brew_installed
+    brew_installed=$(brew list --formula -1 2> /dev/null || true)
     for dep in tesseract poppler; do
-        if ! brew list "$dep" &> /dev/null; then
+        if ! grep -qxF "$dep" <<< "$brew_installed"; then
             log_error "System dependency '$dep' is not installed via Homebrew. Please run: brew install $dep"
             missing_deps=$((missing_deps + 1))
         fi
@@ -39,7 +39,9 @@ add_to_shell_profile() {
         return
     fi
 
-    if [ -f "$shell_profile" ] && grep -q "export PATH=.*$path_to_add" "$shell_profile"; then
+    # Fixed-string match: $path_to_add contains dots and slashes that a regex
+    # would misinterpret, and grep -F skips regex compilation entirely.
+    if [ -f "$shell_profile" ] && grep -qF -- "$path_to_add" "$shell_profile"; then
         log_info "'$path_to_add' is already in the PATH in '$shell_profile'."
     else
         log_info "Adding '$path_to_add' to PATH in '$shell_profile'."
@@ -53,8 +55,12 @@ add_to_shell_profile() {
 pre_flight_checks() {
     log_info "Running pre-flight system checks..."
     local errors=0
-    # 1. Check for Xcode Command Line Tools (essential for Homebrew builds)
-    if ! xcode-select -p &> /dev/null; then
+    # 1. Check for Xcode Command Line Tools (essential for Homebrew builds).
+    # Directory tests cover the standard install locations without forking;
+    # xcode-select only runs when a custom developer dir might be in play.
+    if ! { [ -d /Library/Developer/CommandLineTools/usr/bin ] \
+            || [ -d /Applications/Xcode.app ] \
+            || xcode-select -p &> /dev/null; }; then
         log_error "Xcode Command Line Tools not found. This is required to build packages."
         log_error "Please run 'xcode-select --install' in your terminal and try again."
         errors=$((errors + 1))
@@ -72,10 +78,20 @@ pre_flight_checks() {
     log_info "Pre-flight system checks passed."
 }
 
+# Cached snapshot of installed formulas so repeated presence checks don't
+# fork brew (and its Ruby startup) once per package.
+BREW_INSTALLED=""
+brew_has() {
+    if [ -z "$BREW_INSTALLED" ]; then
+        BREW_INSTALLED=$(brew list --formula -1 2> /dev/null || true)
+    fi
+    grep -qxF "$1" <<< "$BREW_INSTALLED"
+}
+
 install_brew_dependency() {
     local package="$1"
     log_info "Checking for Homebrew package: '$package'..."
-    if brew list "$package" &> /dev/null; then
+    if brew_has "$package"; then
         log_info "'$package' is already installed."
     else
         log_info "'$package' not found. Attempting installation..."
@@ -17,8 +17,11 @@ if __name__ == "__main__":
     if not os.path.exists(MARKDOWN_OUTPUT_DIR):
         os.makedirs(MARKDOWN_OUTPUT_DIR)
 
-    # Find all PDF files in the source directory
-    pdf_files = [f for f in os.listdir(PDF_SOURCE_DIR) if f.lower().endswith(".pdf")]
+    # Find all PDF files in the source directory. os.scandir avoids a stat
+    # per entry and the tuple endswith skips a per-name .lower() allocation.
+    with os.scandir(PDF_SOURCE_DIR) as entries:
+        pdf_files = [e.name for e in entries
+                     if e.is_file(follow_symlinks=False) and e.name.endswith((".pdf", ".PDF"))]
 
     if not pdf_files:
         print("No PDF files found in the current directory.")
@@ -5,8 +5,17 @@ from pdf2image import convert_from_path
 import pdfplumber
 from unstructured.partition.pdf import partition_pdf
 
-# Initialize OCR
-reader = easyocr.Reader(['en'])
+# Lazy OCR initialization: easyocr.Reader loads ~100MB of model weights, so
+# it is only built the first time the OCR fallback actually runs. Runs that
+# stop at unstructured/pdfplumber never pay for it.
+_reader = None
+
+def _get_reader():
+    global _reader
+    if _reader is None:
+        import torch
+        _reader = easyocr.Reader(['en'], gpu=torch.cuda.is_available())
+    return _reader
 
 # Folder containing PDFs
 pdf_folder = "."
@@ -25,6 +34,7 @@ def extract_text_with_pdfplumber(pdf_path):
 def extract_text_with_ocr(pdf_path):
     try:
         images = convert_from_path(pdf_path)
+        reader = _get_reader()
         text = []
         for image in images:
             result = reader.readtext(image)
@@ -43,23 +53,15 @@ def extract_text_with_unstructured(pdf_path):
         print(f"Error with unstructured on {pdf_path}: {e}")
         return ""
 
-def synthesize_text(pdf_text, ocr_text, unstructured_text):
-    # Prefer unstructured if it's non-empty, otherwise fall back to OCR or PDF text
-    if unstructured_text and len(unstructured_text.strip()) > 50:
-        return unstructured_text
-    elif ocr_text and len(ocr_text.strip()) > 50:
-        return ocr_text
-    else:
-        return pdf_text
-
 def process_pdf(pdf_path, output_folder):
-    # Extract text with all methods
-    pdf_text = extract_text_with_pdfplumber(pdf_path)
-    ocr_text = extract_text_with_ocr(pdf_path)
-    unstructured_text = extract_text_with_unstructured(pdf_path)
-
-    # Synthesize the best text
-    final_text = synthesize_text(pdf_text, ocr_text, unstructured_text)
+    # Lazy fallback chain: each tier only runs if the previous one produced
+    # too little text. This keeps the expensive EasyOCR pass (by far the
+    # slowest extractor) off the hot path for ordinary text PDFs.
+    final_text = extract_text_with_unstructured(pdf_path)
+    if len(final_text.strip()) < 50:
+        final_text = extract_text_with_pdfplumber(pdf_path)
+    if len(final_text.strip()) < 50:
+        final_text = extract_text_with_ocr(pdf_path)
 
     # Save to Markdown file
     output_file = os.path.join(output_folder, f"{os.path.splitext(os.path.basename(pdf_path))[0]}.md")
@@ -67,10 +69,12 @@ def process_pdf(pdf_path, output_folder):
         f.write(final_text)
     print(f"Processed {pdf_path} -> {output_file}")
 
-# Process all PDFs
-for filename in os.listdir(pdf_folder):
-    if filename.lower().endswith('.pdf'):
-        process_pdf(os.path.join(pdf_folder, filename), output_folder)
+# Process all PDFs. os.scandir avoids a stat per entry and the tuple
+# endswith skips a per-name .lower() allocation.
+with os.scandir(pdf_folder) as entries:
+    for entry in entries:
+        if entry.is_file(follow_symlinks=False) and entry.name.endswith(('.pdf', '.PDF')):
+            process_pdf(entry.path, output_folder)
 
 print("Pipeline completed!")
 
@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 import fitz  # PyMuPDF
 from pymupdf4llm import to_markdown
 from PIL import Image
@@ -21,12 +22,15 @@ def fallback_ocr_with_pytesseract(pdf_path):
     """
     print("   -> Primary OCR failed. Trying fallback method...")
     try:
-        images = convert_from_path(pdf_path)
-        full_text = []
-        for i, image in enumerate(images):
-            print(f"      -> Processing page {i + 1} with fallback OCR...")
-            text = pytesseract.image_to_string(image)
-            full_text.append(text)
+        # pdf2image parallelizes rasterization itself via thread_count.
+        images = convert_from_path(pdf_path, thread_count=os.cpu_count())
+        if not images:
+            return ""
+        # Each page is an independent CPU-bound Tesseract call, so OCR the
+        # pages in parallel worker processes instead of one at a time.
+        print(f"      -> Processing {len(images)} page(s) with fallback OCR in parallel...")
+        with multiprocessing.Pool(processes=min(os.cpu_count() or 1, len(images))) as pool:
+            full_text = pool.map(pytesseract.image_to_string, images)
         return "\\n\\n--- Page Break ---\\n\\n".join(full_text)
     except Exception as e:
         print(f"      -> Fallback OCR also failed. Error: {e}")
@@ -37,8 +41,13 @@ if __name__ == "__main__":
     os.makedirs(MARKDOWN_OUTPUT_DIR, exist_ok=True)
     os.makedirs(ASSET_OUTPUT_DIR, exist_ok=True)
 
-    pdf_files = [f for f in os.listdir(PDF_SOURCE_DIR) if f.lower().endswith(".pdf")]
-    
+    # os.scandir avoids a stat per entry and the tuple endswith skips a
+    # per-name .lower() allocation.
+    with os.scandir(PDF_SOURCE_DIR) as entries:
+        pdf_files = [e.name for e in entries
+                     if e.is_file(follow_symlinks=False) and e.name.endswith((".pdf", ".PDF"))]
+
+
     if not pdf_files:
         print("No PDF files found in the current directory.")
     else:
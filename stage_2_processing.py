@@ -12,9 +12,11 @@ import json
 import logging
 import argparse
 import time
+from functools import lru_cache
 from typing import Dict, List, Optional
 
 # Third-party imports
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
 from langchain.schema.messages import HumanMessage, SystemMessage
@@ -61,9 +63,24 @@ TEXT_CLEANUP_SYSTEM_PROMPT = """You are an expert technical editor specializing
 
 # --- Core Functions ---
 
+@lru_cache(maxsize=1)
+def _shared_http_client() -> httpx.Client:
+    """
+    Returns the process-wide HTTP client shared by all Azure LLM calls, so
+    repeated requests reuse pooled keep-alive connections instead of paying
+    a fresh TLS handshake each time.
+    """
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+
+@lru_cache(maxsize=1)
 def initialize_llm() -> Optional[AzureChatOpenAI]:
     """
     Initializes and validates the AzureChatOpenAI client from environment variables.
+
+    The result is memoized so repeated callers (API server, Celery workers,
+    per-document loops) share one authenticated client and connection pool.
     """
     required_vars = [
         "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_KEY",
@@ -81,6 +98,7 @@ def initialize_llm() -> Optional[AzureChatOpenAI]:
             api_version=os.getenv("OPENAI_API_VERSION"),
             temperature=0.0,
             max_retries=3,
+            http_client=_shared_http_client(),
         )
     except Exception as e:
         logging.error(f"Failed to initialize AzureChatOpenAI client: {e}")
@@ -7,7 +7,8 @@
 import os
 import logging
 import argparse
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Set
 
 # Third-party imports
 from dotenv import load_dotenv
@@ -43,9 +44,13 @@ Your requirements are:
 
 # --- Core Functions ---
 
+@lru_cache(maxsize=1)
 def initialize_markitdown_client() -> Optional[MarkItDown]:
     """
     Initializes and validates the MarkItDown client from environment variables.
+
+    The result is memoized so repeated callers (API server, Celery workers,
+    per-document loops) share one authenticated client.
     """
     required_vars = [
         "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT",
@@ -73,14 +78,19 @@ def initialize_markitdown_client() -> Optional[MarkItDown]:
         logging.error(f"Failed to initialize MarkItDown client: {e}")
         return None
 
-def process_single_markdown_file(md_client: MarkItDown, md_path: str, output_dir: str):
+def process_single_markdown_file(md_client: MarkItDown, md_path: str, output_dir: str,
+                                 already_done: Optional[Set[str]] = None):
     """
     Orchestrates the final processing for a single Markdown file.
+
+    When the caller pre-scanned the output directory, already_done turns the
+    skip check into a set lookup; standalone callers fall back to a stat.
     """
     base_filename = os.path.splitext(os.path.basename(md_path))[0]
     final_output_path = os.path.join(output_dir, f"{base_filename}.md")
 
-    if os.path.exists(final_output_path):
+    if (f"{base_filename}.md" in already_done if already_done is not None
+            else os.path.exists(final_output_path)):
         logging.info(f"Skipping '{base_filename}', final output already exists.")
         return
 
@@ -128,9 +138,12 @@ def main(args):
         return
 
     logging.info(f"Found {len(md_files)} Markdown document(s) for Stage 3 processing.")
+    # One scan of the output directory replaces a stat syscall per document.
+    with os.scandir(args.output_dir) as entries:
+        already_done = {e.name for e in entries if e.name.endswith(".md")}
     for md_filename in md_files:
         md_path = os.path.join(args.source_dir, md_filename)
-        process_single_markdown_file(md_client, md_path, args.output_dir)
+        process_single_markdown_file(md_client, md_path, args.output_dir, already_done)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Stage 3: Final Document Synthesis with MarkItDown.")
@@ -6,16 +6,53 @@
 # It also generates quantitative quality reports for each output file.
 
 import os
-import json
+import asyncio
+import hashlib
 import logging
 import argparse
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 
 # Third-party imports
+import httpx
 from dotenv import load_dotenv
 from markitdown import MarkItDown, ConvertResult
-from tenacity import retry, stop_after_attempt, wait_exponential
+from openai import APIConnectionError, APITimeoutError, AzureOpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# Conditional import for exact token estimation; a chars/4 heuristic is the
+# fallback when the wheel is not installed.
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# orjson serializes at C speed straight to UTF-8 bytes, ~5-10x faster than
+# the stdlib encoder; the stage still runs without the wheel.
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    ORJSON_AVAILABLE = False
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serializes to UTF-8 bytes with orjson when available."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None,
+                      separators=None if indent else (",", ":")).encode("utf-8")
+
+def json_loads(data) -> Any:
+    """Deserializes bytes/str with orjson when available."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
 
 # --- Load Environment Variables ---
 # Allows the script to be run standalone for testing. The master script
@@ -25,6 +62,12 @@ load_dotenv()
 # --- Configuration Constants ---
 PROCESSING_LOG_FILE = "_stage3_processing.json"
 QUALITY_REPORT_FILE_SUFFIX = "_quality_report.json"
+BATCH_POLL_INITIAL_SECONDS = 30
+BATCH_POLL_MAX_SECONDS = 600
+RESPONSE_CACHE_FILE = ".stage3_cache.sqlite"
+# Documents under this size are candidates for row-marshaling; larger ones
+# would blow up per-request latency for every document sharing the call.
+MARSHAL_SIZE_LIMIT = 32 * 1024
 
 # --- Setup Logging ---
 logging.basicConfig(
@@ -34,18 +77,22 @@ logging.basicConfig(
 )
 
 # --- LLM Prompt for Final Synthesis ---
+# This prompt is the byte-identical prefix of every request in a run. Azure
+# OpenAI caches prompt prefixes past ~1024 tokens automatically, so keeping
+# it static and first in the message list lets every document after the
+# first hit the cached KV prefix (discounted, lower-latency input tokens).
+# Any edit to this string invalidates the cache for the whole run.
 LLM_PROMPT = """You are an expert technical writer and editor with deep knowledge of classic Apple computer systems, including the Apple II series and classic Macintosh hardware and software (System 6/7).
 
 You will be given a Markdown document that has been pre-processed. This document contains:
 1.  Text extracted via OCR from a vintage technical manual or book, which has already undergone a preliminary cleanup.
-2.  A dedicated section at the end titled '## Extracted Image Analysis' which contains structured descriptions of all images, diagrams, and screenshots from the original document.
+2.  Image descriptions already integrated inline as blockquotes next to their references, with any that could not be placed collected in a trailing '## Image Appendix' section.
 
 Your task is to perform a final, definitive synthesis to create a comprehensive, clean, and publication-ready technical document.
 
 Your requirements are:
-- **Integrate Content:** Seamlessly weave the image descriptions from the 'Extracted Image Analysis' section into the main body of the text where they are contextually relevant. For example, if the text mentions "Figure 2A", find the analysis for that image and insert it as a descriptive blockquote or figure caption immediately following the reference.
-- **Synthesize, Don't Just Copy:** Use the image descriptions to enrich the main text. The descriptions are high-quality; treat them as authoritative.
-- **Remove Redundancy:** After integrating the image descriptions, REMOVE the entire '## Extracted Image Analysis' section from the end of the document.
+- **Polish Captions:** Refine the inline image blockquotes so they read as natural figure captions in context. The descriptions are high-quality; treat them as authoritative.
+- **Place Appendix Entries:** If an '## Image Appendix' section is present, move each of its entries to where it is contextually relevant in the main body, then remove the appendix.
 - **Format for Clarity:** Ensure the final document has a clear hierarchical structure using appropriate Markdown headings (`#`, `##`, `###`).
 - **Correct and Format:** Fix any remaining OCR errors, format tables using proper Markdown syntax, and ensure code blocks are correctly identified with language specifiers (e.g., ```assembly, ```c, ```pascal).
 - **Preserve Accuracy:** Maintain all technical specifications, historical context, and original terminology with absolute fidelity.
@@ -54,8 +101,15 @@ Your requirements are:
 
 # --- Core Functions ---
 
+@lru_cache(maxsize=1)
 def initialize_markitdown_client() -> Optional[MarkItDown]:
-    """Initializes and validates the MarkItDown client from environment variables."""
+    """Initializes and validates the MarkItDown client from environment variables.
+
+    Memoized: library importers and respawned workers share one constructed
+    client instead of re-reading env vars and re-paying Azure SDK setup per
+    call. (The local post-processing pool never touches the client, so no
+    per-child initializer is needed there.)
+    """
     required_vars = [
         "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT", "AZURE_DOCUMENT_INTELLIGENCE_KEY",
         "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_KEY", "AZURE_OPENAI_DEPLOYMENT_NAME"
@@ -78,80 +132,567 @@ def initialize_markitdown_client() -> Optional[MarkItDown]:
         logging.error(f"Failed to initialize MarkItDown client: {e}")
         return None
 
-@retry(wait=wait_exponential(multiplier=1, min=4, max=10), stop=stop_after_attempt(3))
+class ResponseCache:
+    """Persistent LLM response cache keyed on the prompt + input content.
+
+    The existence check on final_output_path only protects one output
+    directory; this cache survives re-runs into fresh destinations, so
+    iterative developer runs skip re-synthesizing documents whose Stage 2
+    content has not changed. Safe to share across the to_thread workers.
+    """
+
+    def __init__(self, db_path: str):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, text_content BLOB, created_at INT)")
+        self._conn.commit()
+
+    @staticmethod
+    def key_for(content: str) -> str:
+        """Hashes the prompt together with the content: a prompt edit must miss."""
+        return hashlib.sha256((LLM_PROMPT + "\x00" + content).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text_content FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0].decode("utf-8") if row else None
+
+    def set(self, key: str, text_content: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, text_content.encode("utf-8"), int(time.time())))
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+# Retry only what can plausibly succeed on a second attempt: rate limits,
+# timeouts, and transport-level failures. Auth errors, 400s, and malformed
+# content fail the same way every time, so they propagate straight to the
+# failed bucket instead of burning ~30s of backoff per bad file. Jittered
+# exponential backoff keeps concurrent retries from re-colliding.
+@retry(retry=retry_if_exception_type((RateLimitError, APITimeoutError,
+                                      APIConnectionError, httpx.TransportError)),
+       wait=wait_random_exponential(multiplier=1, max=30),
+       stop=stop_after_attempt(5), reraise=True)
 def convert_with_retry(md_client: MarkItDown, content: str) -> ConvertResult:
-    """Invokes the MarkItDown convert method with a retry strategy."""
+    """Invokes the MarkItDown convert method, retrying transient failures only."""
     logging.debug("Invoking MarkItDown.convert...")
     return md_client.convert(content)
 
+# Compiled once at import: one C-level scan classifies every structural line,
+# replacing four splitlines()-backed Python passes (and the line-list
+# allocation) over multi-MB synthesized manuals.
+_QUALITY_PATTERN = re.compile(r"(?m)^[ \t]*(#+ |[-*+] |\d+\. |\|)")
+
 def analyze_markdown_quality(content: str) -> Dict[str, Any]:
     """Analyzes the quality and structure of the final Markdown content."""
-    lines = content.splitlines()
+    header_count = table_row_count = list_item_count = 0
+    for match in _QUALITY_PATTERN.finditer(content):
+        token = match.group(1)
+        if token[0] == "#":
+            header_count += 1
+        elif token[0] == "|":
+            table_row_count += 1
+        else:
+            list_item_count += 1
+
+    # count("\n") runs in C and skips the splitlines() allocation; a trailing
+    # newline does not start another line, matching splitlines() semantics.
+    total_lines = content.count("\n")
+    if content and not content.endswith("\n"):
+        total_lines += 1
+
     metrics = {
-        "total_lines": len(lines),
+        "total_lines": total_lines,
         "total_characters": len(content),
-        "header_count": sum(1 for line in lines if line.strip().startswith("#")),
+        "header_count": header_count,
         "code_block_count": content.count("```") // 2,
-        "table_row_count": sum(1 for line in lines if "|" in line and line.strip().startswith("|")),
-        "list_item_count": sum(1 for line in lines if line.strip().startswith(("- ", "* ", "+ ")) or (line.strip() and line.strip()[0].isdigit() and ". " in line[:5])),
+        "table_row_count": table_row_count,
+        "list_item_count": list_item_count,
         "image_reference_count": content.count("!["),
     }
     return metrics
 
-def process_single_document(md_client: MarkItDown, md_path: str, output_dir: str) -> Dict[str, Any]:
-    """Orchestrates the final processing and quality analysis for a single file."""
-    base_filename = os.path.splitext(os.path.basename(md_path))[0]
+# Matches the section delimiter and per-image entries exactly as Stage 2
+# emits them (see the analysis-section writer in stage_2_processing_final).
+_IMAGE_SECTION_PATTERN = re.compile(r"(?m)^(?:---\s*\n+)?## Extracted Image Analysis\s*$")
+_IMAGE_ENTRY_PATTERN = re.compile(
+    r"### Image: `(?P<filename>[^`]+)`\n"
+    r"- \*\*Category:\*\* (?P<category>.*)\n"
+    r"- \*\*Key Entities:\*\* (?P<entities>.*)\n"
+    r"> (?P<description>.*)")
+
+def preintegrate(content: str) -> str:
+    """Folds the Stage 2 image-analysis section into the body locally.
+
+    The old prompt had the LLM integrate the trailing section and then
+    delete it — paying input tokens to ship boilerplate the model was told
+    to discard. This inlines each description as a blockquote right after
+    the line that references its image file, at zero API cost; entries with
+    no in-text reference land in a compact '## Image Appendix' for the LLM
+    to place. On image-heavy manuals this roughly halves input tokens.
+    """
+    section_match = _IMAGE_SECTION_PATTERN.search(content)
+    if not section_match:
+        return content
+
+    body = content[:section_match.start()].rstrip()
+    unplaced = []
+    for entry in _IMAGE_ENTRY_PATTERN.finditer(content, section_match.end()):
+        filename = entry["filename"]
+        caption = (f"> **{os.path.splitext(filename)[0]} ({entry['category']}):** "
+                   f"{entry['description']}")
+        line_match = re.search(rf"(?m)^.*{re.escape(filename)}.*$", body)
+        if line_match:
+            insert_at = line_match.end()
+            body = f"{body[:insert_at]}\n{caption}{body[insert_at:]}"
+        else:
+            unplaced.append(caption)
+
+    if unplaced:
+        body += "\n\n## Image Appendix\n\n" + "\n\n".join(unplaced)
+    return body + "\n"
+
+class AzureRateLimiter:
+    """Client-side token bucket mirroring the deployment's RPM/TPM caps.
+
+    Requests stall locally until both the request and the token budget allow
+    them, so throughput rides just under the provider's limits instead of
+    bouncing off 429s and paying retry backoff.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self._rpm = rpm
+        self._tpm = tpm
+        self._request_allowance = float(rpm)
+        self._token_allowance = float(tpm)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def reserve(self, estimated_tokens: int) -> None:
+        """Blocks until one request and estimated_tokens fit in the budget."""
+        # The allowance never exceeds tpm, so a request estimated above it
+        # could never be satisfied and would stall the whole gather forever.
+        # Clamp the reservation to the cap: such a request drains the full
+        # budget and proceeds alone, letting the provider arbitrate instead.
+        if estimated_tokens > self._tpm:
+            logging.warning(
+                f"Request estimated at {estimated_tokens} token(s) exceeds the "
+                f"TPM cap of {self._tpm}; clamping the reservation to the cap.")
+            estimated_tokens = self._tpm
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._last_refill
+                self._last_refill = now
+                self._request_allowance = min(
+                    float(self._rpm), self._request_allowance + elapsed * self._rpm / 60.0)
+                self._token_allowance = min(
+                    float(self._tpm), self._token_allowance + elapsed * self._tpm / 60.0)
+                if self._request_allowance >= 1.0 and self._token_allowance >= estimated_tokens:
+                    self._request_allowance -= 1.0
+                    self._token_allowance -= estimated_tokens
+                    return
+                wait = max((1.0 - self._request_allowance) * 60.0 / self._rpm,
+                           (estimated_tokens - self._token_allowance) * 60.0 / self._tpm)
+            logging.debug(f"Rate limiter stalling {wait:.2f}s for {estimated_tokens} token(s).")
+            await asyncio.sleep(wait)
+
+# Pre-warmed at import: loading the BPE merges costs on the order of 100ms,
+# better paid once per process than on the first metered request of a run.
+# o200k_base is the encoding behind the gpt-4o family.
+_TOKEN_ENCODER = tiktoken.get_encoding("o200k_base") if TIKTOKEN_AVAILABLE else None
+_PROMPT_TOKEN_COUNT = len(_TOKEN_ENCODER.encode(LLM_PROMPT)) if _TOKEN_ENCODER else 0
+
+def estimate_request_tokens(content: str) -> int:
+    """Estimates the input tokens one synthesis request will consume."""
+    if _TOKEN_ENCODER is not None:
+        # The prompt prefix is constant, so its count is computed once above.
+        return _PROMPT_TOKEN_COUNT + len(_TOKEN_ENCODER.encode(content))
+    # ~4 chars per token is a safe average for English technical prose.
+    return (len(LLM_PROMPT) + len(content)) // 4 + 1
+
+def append_checkpoint(checkpoint_path: str, stats: Dict[str, Any]) -> None:
+    """Durably appends one per-document result to the crash-recovery log.
+
+    flush + fsync per line: if the run dies on document 99 of 100, the 98
+    completed results survive and the next run resumes in O(1) instead of
+    losing all tracking.
+    """
+    with open(checkpoint_path, "ab") as f:
+        f.write(json_dumps(stats) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_stage2_input(md_path: str) -> str:
+    """Reads and pre-integrates one Stage 2 document."""
+    # 1 MiB buffers: multi-MB manuals move in a handful of syscalls
+    # instead of the default 8 KiB chunks.
+    with open(md_path, 'r', encoding='utf-8', buffering=1 << 20) as f:
+        raw_content = f.read()
+    content_from_stage2 = preintegrate(raw_content)
+    if len(content_from_stage2) < len(raw_content):
+        logging.info(f"Pre-integration shrank '{os.path.basename(md_path)}' from "
+                     f"{len(raw_content):,} to {len(content_from_stage2):,} chars.")
+    return content_from_stage2
+
+def llm_phase(md_client: MarkItDown, content_from_stage2: str,
+              cache: Optional[ResponseCache] = None,
+              cache_key: Optional[str] = None) -> str:
+    """Network-bound half: obtains the synthesis and stores it in the cache."""
+    result = convert_with_retry(md_client, content_from_stage2)
+    if cache:
+        cache.set(cache_key, result.text_content)
+    return result.text_content
+
+def local_phase(base_filename: str, final_content: str, output_dir: str,
+                pretty: bool = False) -> Dict[str, Any]:
+    """CPU-bound half: writes the document, scores it, and emits the report.
+
+    Runs in a worker process so quality scans of finished documents overlap
+    with the LLM round-trips still in flight instead of blocking between
+    them.
+    """
     final_output_path = os.path.join(output_dir, f"{base_filename}.md")
+    with open(final_output_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(final_content)
+
+    final_size_kb = os.path.getsize(final_output_path) / 1024
+    logging.info(f"Successfully synthesized and saved final document to '{final_output_path}' ({final_size_kb:.2f} KB)")
+
+    # Generate and save quality report
+    quality_metrics = analyze_markdown_quality(final_content)
+    report_path = os.path.join(output_dir, f"{base_filename}{QUALITY_REPORT_FILE_SUFFIX}")
+    # Compact by default; indentation only when --pretty asks for it.
+    with open(report_path, 'wb') as f:
+        f.write(json_dumps(quality_metrics, indent=pretty))
+    logging.info(f"Saved quality report to '{report_path}'")
+
+    return {"final_size_kb": round(final_size_kb, 2), "quality_metrics": quality_metrics}
+
+async def process_single_document_async(md_client: MarkItDown, md_path: str, output_dir: str,
+                                         semaphore: asyncio.Semaphore,
+                                         local_executor: ProcessPoolExecutor,
+                                         existing_outputs: set,
+                                         limiter: AzureRateLimiter,
+                                         checkpoint_path: str,
+                                         cache: Optional[ResponseCache] = None,
+                                         pretty: bool = False,
+                                         min_chars: int = 500) -> Dict[str, Any]:
+    """Pipelines one document through the network and local phases.
+
+    MarkItDown is synchronous, so the convert call moves off the event loop
+    via asyncio.to_thread with the semaphore capping in-flight Azure
+    round-trips; the pure-CPU post-processing then runs on the shared
+    process pool, overlapping with other documents' LLM calls.
+    """
+    base_filename = os.path.splitext(os.path.basename(md_path))[0]
     stats = {"document": base_filename, "status": "skipped", "final_size_kb": 0}
 
-    if os.path.exists(final_output_path):
+    if f"{base_filename}.md" in existing_outputs:
         logging.info(f"Skipping '{base_filename}', final output already exists.")
         return stats
 
     logging.info(f"--- Processing document: {base_filename} ---")
     stats["status"] = "processing"
-
     try:
-        with open(md_path, 'r', encoding='utf-8') as f:
-            content_from_stage2 = f.read()
-
-        result = convert_with_retry(md_client, content_from_stage2)
-        final_content = result.text_content
-
-        with open(final_output_path, 'w', encoding='utf-8') as f:
-            f.write(final_content)
-        
-        final_size_kb = os.path.getsize(final_output_path) / 1024
-        stats["final_size_kb"] = round(final_size_kb, 2)
-        logging.info(f"Successfully synthesized and saved final document to '{final_output_path}' ({final_size_kb:.2f} KB)")
-
-        # Generate and save quality report
-        quality_metrics = analyze_markdown_quality(final_content)
-        report_path = os.path.join(output_dir, f"{base_filename}{QUALITY_REPORT_FILE_SUFFIX}")
-        with open(report_path, 'w', encoding='utf-8') as f:
-            json.dump(quality_metrics, f, indent=2)
-        logging.info(f"Saved quality report to '{report_path}'")
+        content_from_stage2 = await asyncio.to_thread(read_stage2_input, md_path)
 
-        stats["status"] = "success"
-        stats["quality_metrics"] = quality_metrics
-        return stats
+        # Near-empty inputs (failed OCR, corrupt scans) gain nothing from a
+        # full synthesis; write them through and save the tokens and latency.
+        if len(content_from_stage2) < min_chars:
+            logging.warning(f"'{base_filename}' has only {len(content_from_stage2)} chars of "
+                            "Stage 2 content; passing through without synthesis.")
+            loop = asyncio.get_running_loop()
+            stats.update(await loop.run_in_executor(
+                local_executor, local_phase, base_filename, content_from_stage2,
+                output_dir, pretty))
+            stats["status"] = "passthrough"
+            await asyncio.to_thread(append_checkpoint, checkpoint_path, stats)
+            return stats
+
+        cache_key = cache.key_for(content_from_stage2) if cache else None
+        final_content = await asyncio.to_thread(cache.get, cache_key) if cache else None
+        if final_content is not None:
+            logging.info(f"Response cache hit for '{base_filename}'; skipping LLM synthesis.")
+            stats["cache_hit"] = True
+        else:
+            # Cache misses pay into the shared rate budget before dispatch;
+            # hits cost the provider nothing and bypass the limiter.
+            await limiter.reserve(estimate_request_tokens(content_from_stage2))
+            async with semaphore:
+                final_content = await asyncio.to_thread(
+                    llm_phase, md_client, content_from_stage2, cache, cache_key)
+        del content_from_stage2
 
+        loop = asyncio.get_running_loop()
+        stats.update(await loop.run_in_executor(
+            local_executor, local_phase, base_filename, final_content, output_dir, pretty))
+        stats["status"] = "success"
     except Exception as e:
         logging.error(f"FATAL ERROR processing {base_filename} in Stage 3: {e}", exc_info=True)
         stats["status"] = "failed"
         stats["error"] = str(e)
-        return stats
+    await asyncio.to_thread(append_checkpoint, checkpoint_path, stats)
+    return stats
 
-def main(args):
-    """Main function to find and process Stage 2 markdown files."""
+# The marshaling contract rides in the user message, not LLM_PROMPT, so the
+# cached system-prompt prefix stays byte-identical with unmarshaled requests.
+_MARSHAL_INSTRUCTION = (
+    "The following input contains multiple independent documents, each "
+    "introduced by a '<<<DOC id=...>>>' delimiter line. Process each document "
+    "separately according to your instructions, and reproduce the exact same "
+    "delimiter line before each document's output. Do not merge documents or "
+    "drop any delimiter.\n\n")
+_MARSHAL_SPLIT_PATTERN = re.compile(r"<<<DOC id=([^>]+)>>>")
+
+async def process_marshaled_group(md_client: MarkItDown, group: list, output_dir: str,
+                                  semaphore: asyncio.Semaphore,
+                                  local_executor: ProcessPoolExecutor,
+                                  limiter: AzureRateLimiter,
+                                  checkpoint_path: str,
+                                  pretty: bool = False) -> list:
+    """Synthesizes several small documents in one delimiter-separated request.
+
+    One API call per short pamphlet is dominated by fixed per-request
+    overhead; concatenating a group under '<<<DOC id=...>>>' delimiters
+    amortizes it and stretches the RPM budget. The response is split back on
+    the same delimiters and each section goes through the normal local
+    phase. Marshaled calls skip the response cache: the group composition
+    would poison content-keyed lookups.
+    """
+    doc_ids, sections = [], []
+    for name, path in group:
+        doc_id = os.path.splitext(name)[0]
+        doc_ids.append(doc_id)
+        content = await asyncio.to_thread(read_stage2_input, path)
+        sections.append(f"<<<DOC id={doc_id}>>>\n{content}")
+    combined = _MARSHAL_INSTRUCTION + "\n\n".join(sections)
+    logging.info(f"Marshaling {len(group)} small document(s) into one request: {', '.join(doc_ids)}")
+
+    stats_by_id = {doc_id: {"document": doc_id, "status": "failed",
+                            "final_size_kb": 0, "marshaled": True}
+                   for doc_id in doc_ids}
+    try:
+        await limiter.reserve(estimate_request_tokens(combined))
+        async with semaphore:
+            response_text = await asyncio.to_thread(
+                lambda: convert_with_retry(md_client, combined).text_content)
+
+        # split() yields [preamble, id, text, id, text, ...].
+        parts = _MARSHAL_SPLIT_PATTERN.split(response_text)
+        loop = asyncio.get_running_loop()
+        for doc_id, text in zip(parts[1::2], parts[2::2]):
+            doc_id = doc_id.strip()
+            if doc_id not in stats_by_id:
+                logging.warning(f"Marshaled response contained unknown id '{doc_id}'.")
+                continue
+            stats = stats_by_id[doc_id]
+            stats.update(await loop.run_in_executor(
+                local_executor, local_phase, doc_id, text.strip() + "\n", output_dir, pretty))
+            stats["status"] = "success"
+        for doc_id, stats in stats_by_id.items():
+            if stats["status"] != "success":
+                stats["error"] = "missing from marshaled response"
+                logging.error(f"Marshaled response missing document '{doc_id}'.")
+    except Exception as e:
+        logging.error(f"FATAL ERROR processing marshaled group {doc_ids}: {e}", exc_info=True)
+        for stats in stats_by_id.values():
+            stats["error"] = str(e)
+    for stats in stats_by_id.values():
+        await asyncio.to_thread(append_checkpoint, checkpoint_path, stats)
+    return list(stats_by_id.values())
+
+# --- Batch Mode ---
+
+def initialize_batch_client() -> Optional[AzureOpenAI]:
+    """Initializes the raw Azure OpenAI client used by the Batch API path."""
+    # AZURE_OPENAI_DEPLOYMENT_NAME is not passed to the client itself, but
+    # build_batch_jsonl dereferences it for every request line, so validate
+    # it up front with the rest.
+    required_vars = ["AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_KEY",
+                     "OPENAI_API_VERSION", "AZURE_OPENAI_DEPLOYMENT_NAME"]
+    if not all(os.getenv(var) for var in required_vars):
+        logging.error("One or more required Azure OpenAI environment variables are not set.")
+        logging.error(f"Required: {', '.join(required_vars)}")
+        return None
+    try:
+        return AzureOpenAI(
+            azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_KEY"],
+            api_version=os.environ["OPENAI_API_VERSION"]
+        )
+    except Exception as e:
+        logging.error(f"Failed to initialize Azure OpenAI client: {e}")
+        return None
+
+def build_batch_jsonl(source_files: List[str], source_dir: str) -> bytes:
+    """Packages every pending document into one Batch API input file.
+
+    One JSONL line per document, keyed by custom_id so the outputs can be
+    mapped back to filenames when the job completes.
+    """
+    deployment = os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"]
+    lines = []
+    for md_filename in source_files:
+        with open(os.path.join(source_dir, md_filename), "r", encoding="utf-8") as f:
+            content = f.read()
+        lines.append(json_dumps({
+            "custom_id": os.path.splitext(md_filename)[0],
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": {
+                "model": deployment,
+                "temperature": 0,
+                "messages": [
+                    {"role": "system", "content": LLM_PROMPT},
+                    {"role": "user", "content": content}
+                ]
+            }
+        }))
+    return b"\n".join(lines) + b"\n"
+
+def wait_for_batch(client: AzureOpenAI, batch_id: str) -> Any:
+    """Polls the batch job with capped exponential backoff until it terminates."""
+    delay = BATCH_POLL_INITIAL_SECONDS
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch
+        logging.info(f"Batch '{batch_id}' status: {batch.status}; next poll in {delay}s.")
+        time.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX_SECONDS)
+
+def main_batch(args):
+    """Runs Stage 3 through the Azure OpenAI Batch API.
+
+    One upload, one job, one download: roughly half the per-token cost of
+    the realtime endpoint and no client-side rate limiting, in exchange for
+    an up-to-24h completion window.
+    """
+    client = initialize_batch_client()
+    if not client:
+        logging.error("Halting pipeline due to Azure OpenAI client initialization failure.")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with os.scandir(args.output_dir) as entries:
+        existing_outputs = {e.name for e in entries if e.name.endswith(".md")}
+    with os.scandir(args.source_dir) as entries:
+        source_files = [e.name for e in entries
+                        if e.is_file(follow_symlinks=False)
+                        and e.name.lower().endswith(".md")
+                        and e.name not in existing_outputs]
+    if not source_files:
+        logging.info("No pending Markdown documents for batch processing.")
+        return
+    logging.info(f"Submitting {len(source_files)} document(s) as one batch job.")
+
+    overall_stats = {
+        "start_time": datetime.now().isoformat(),
+        "total_files": len(source_files),
+        "successful": 0, "failed": 0, "skipped": 0,
+        "prompt_tokens": 0, "cached_prompt_tokens": 0,
+        "processing_details": []
+    }
+
+    batch_input = client.files.create(
+        file=("stage3_batch.jsonl", build_batch_jsonl(source_files, args.source_dir)),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    logging.info(f"Batch job '{batch.id}' submitted; polling for completion.")
+    batch = wait_for_batch(client, batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        logging.error(f"Batch job '{batch.id}' ended with status '{batch.status}'.")
+        overall_stats["failed"] = len(source_files)
+    else:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            entry = json_loads(line)
+            custom_id = entry.get("custom_id", "unknown")
+            stats = {"document": custom_id, "status": "failed", "final_size_kb": 0}
+            response = entry.get("response") or {}
+            if response.get("status_code") == 200:
+                # Track how much of the shared LLM_PROMPT prefix was served
+                # from the provider's prompt cache (see note above LLM_PROMPT).
+                usage = response["body"].get("usage") or {}
+                overall_stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                overall_stats["cached_prompt_tokens"] += (
+                    (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+                final_content = response["body"]["choices"][0]["message"]["content"]
+                final_output_path = os.path.join(args.output_dir, f"{custom_id}.md")
+                with open(final_output_path, "w", encoding="utf-8") as f:
+                    f.write(final_content)
+                stats["final_size_kb"] = round(len(final_content.encode("utf-8")) / 1024, 2)
+                quality_metrics = analyze_markdown_quality(final_content)
+                report_path = os.path.join(args.output_dir, f"{custom_id}{QUALITY_REPORT_FILE_SUFFIX}")
+                with open(report_path, "wb") as f:
+                    f.write(json_dumps(quality_metrics, indent=args.pretty))
+                stats["status"] = "success"
+                stats["quality_metrics"] = quality_metrics
+            else:
+                stats["error"] = str(entry.get("error") or response.get("status_code"))
+                logging.error(f"Batch entry for '{custom_id}' failed: {stats['error']}")
+            overall_stats["processing_details"].append(stats)
+            overall_stats["successful" if stats["status"] == "success" else "failed"] += 1
+
+    overall_stats["end_time"] = datetime.now().isoformat()
+    log_path = os.path.join(args.output_dir, PROCESSING_LOG_FILE)
+    with open(log_path, "wb") as f:
+        f.write(json_dumps(overall_stats, indent=True))
+    logging.info("--- Stage 3 Batch Complete: "
+                 f"{overall_stats['successful']}/{overall_stats['total_files']} succeeded ---")
+    if overall_stats["prompt_tokens"]:
+        logging.info(f"  Prompt cache: {overall_stats['cached_prompt_tokens']:,} of "
+                     f"{overall_stats['prompt_tokens']:,} input tokens served from cache.")
+
+async def main_async(args):
+    """Main function to find and process Stage 2 markdown files concurrently."""
     md_client = initialize_markitdown_client()
     if not md_client:
         logging.error("Halting pipeline due to MarkItDown client initialization failure.")
         return
 
     os.makedirs(args.output_dir, exist_ok=True)
-    source_files = [f for f in os.listdir(args.source_dir) if f.lower().endswith(".md")]
-    logging.info(f"Found {len(source_files)} Markdown document(s) for Stage 3 processing.")
+    # scandir carries the cached d_type and the joined path on each entry, so
+    # no per-name stat and no os.path.join in the task loop below.
+    with os.scandir(args.source_dir) as entries:
+        source_files = [(e.name, e.path) for e in entries
+                        if e.is_file(follow_symlinks=False) and e.name.lower().endswith(".md")]
+    # One directory scan up front turns every per-document skip check from a
+    # filesystem stat into an O(1) set lookup.
+    with os.scandir(args.output_dir) as entries:
+        existing_outputs = {e.name for e in entries if e.name.endswith(".md")}
+    # A leftover checkpoint log means the previous run crashed mid-batch;
+    # replay its successes so that work is not re-bought.
+    log_path = os.path.join(args.output_dir, PROCESSING_LOG_FILE)
+    checkpoint_path = log_path.replace(".json", ".jsonl")
+    if os.path.exists(checkpoint_path):
+        replayed = 0
+        with open(checkpoint_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    continue  # torn final line from the crash
+                if entry.get("status") == "success":
+                    existing_outputs.add(f"{entry['document']}.md")
+                    replayed += 1
+        logging.info(f"Replayed {replayed} completed document(s) from '{checkpoint_path}'.")
+    logging.info(f"Found {len(source_files)} Markdown document(s) for Stage 3 processing "
+                 f"({args.concurrency} concurrent request(s)).")
 
     overall_stats = {
         "start_time": datetime.now().isoformat(),
@@ -160,21 +701,64 @@ def main(args):
         "processing_details": []
     }
 
-    for md_filename in source_files:
-        md_path = os.path.join(args.source_dir, md_filename)
-        stats = process_single_document(md_client, md_path, args.output_dir)
-        overall_stats["processing_details"].append(stats)
-        if stats["status"] == "success":
-            overall_stats["successful"] += 1
-        elif stats["status"] == "failed":
-            overall_stats["failed"] += 1
-        else: # skipped
-            overall_stats["skipped"] += 1
+    # Each call is I/O-bound on an Azure round-trip, so concurrent requests
+    # scale throughput nearly linearly until the rate limit bites.
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = AzureRateLimiter(rpm=args.rpm, tpm=args.tpm)
+    cache = None if args.no_cache else ResponseCache(os.path.join(args.output_dir, RESPONSE_CACHE_FILE))
+    # Pending documents under the size limit ride shared marshaled requests;
+    # everything else keeps its own call (and cache entry).
+    marshal_group_size = max(1, args.marshal_batch)
+    singles, small = [], []
+    for name, path in source_files:
+        if (marshal_group_size > 1 and name not in existing_outputs
+                and args.min_chars <= os.path.getsize(path) < MARSHAL_SIZE_LIMIT):
+            small.append((name, path))
+        else:
+            singles.append((name, path))
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as local_executor:
+            jobs = [([name], process_single_document_async(md_client, md_path,
+                                                           args.output_dir, semaphore,
+                                                           local_executor, existing_outputs,
+                                                           limiter, checkpoint_path,
+                                                           cache, args.pretty,
+                                                           args.min_chars))
+                    for name, md_path in singles]
+            jobs.extend(
+                ([name for name, _ in group],
+                 process_marshaled_group(md_client, group, args.output_dir, semaphore,
+                                         local_executor, limiter, checkpoint_path, args.pretty))
+                for group in (small[start:start + marshal_group_size]
+                              for start in range(0, len(small), marshal_group_size)))
+            results = await asyncio.gather(*(coro for _, coro in jobs),
+                                           return_exceptions=True)
+    finally:
+        if cache:
+            cache.close()
+    for (names, _), result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Unhandled error processing {names}: {result}")
+            result = [{"document": os.path.splitext(name)[0],
+                       "status": "failed", "error": str(result)} for name in names]
+        elif isinstance(result, dict):
+            result = [result]
+        for stats in result:
+            overall_stats["processing_details"].append(stats)
+            if stats["status"] in ("success", "passthrough"):
+                overall_stats["successful"] += 1
+            elif stats["status"] == "failed":
+                overall_stats["failed"] += 1
+            else: # skipped
+                overall_stats["skipped"] += 1
 
     overall_stats["end_time"] = datetime.now().isoformat()
-    log_path = os.path.join(args.output_dir, PROCESSING_LOG_FILE)
-    with open(log_path, "w", encoding="utf-8") as f:
-        json.dump(overall_stats, f, indent=2)
+    with open(log_path, "wb") as f:
+        f.write(json_dumps(overall_stats, indent=True))
+    # The summary now holds everything the checkpoint log recorded.
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
 
     logging.info("--- Stage 3 Complete: Summary ---")
     logging.info(f"  Files processed: {overall_stats['successful']}/{overall_stats['total_files']}")
@@ -186,5 +770,29 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Stage 3: Final Document Synthesis with MarkItDown.")
     parser.add_argument("--source-dir", required=True, help="Directory containing Stage 2 processed Markdown files.")
     parser.add_argument("--output-dir", required=True, help="Directory to save the final synthesized documents.")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="Maximum number of concurrent synthesis requests (default: 10).")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Worker processes for local post-processing (default: CPU count - 1).")
+    parser.add_argument("--min-chars", type=int, default=500,
+                        help="Inputs below this many characters are written through "
+                             "without LLM synthesis (default: 500).")
+    parser.add_argument("--marshal-batch", type=int, default=4,
+                        help="Number of small (<32 KB) documents to marshal into one "
+                             "request; 1 disables marshaling (default: 4).")
+    parser.add_argument("--rpm", type=int, default=500,
+                        help="Deployment requests-per-minute cap for the client-side rate limiter.")
+    parser.add_argument("--tpm", type=int, default=60000,
+                        help="Deployment tokens-per-minute cap for the client-side rate limiter.")
+    parser.add_argument("--pretty", action="store_true",
+                        help="Indent per-document quality reports (compact by default).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the persistent LLM response cache and force re-synthesis.")
+    parser.add_argument("--mode", choices=["realtime", "batch"], default="realtime",
+                        help="realtime: concurrent per-file calls; batch: one Azure OpenAI "
+                             "Batch API job (~50%% cheaper, up to 24h turnaround).")
     args = parser.parse_args()
-    main(args)
+    if args.mode == "batch":
+        main_batch(args)
+    else:
+        asyncio.run(main_async(args))
@@ -0,0 +1,32 @@
+#!/bin/bash
+# start_api_server.sh - API Server Launch Script
+#
+# Starts the FastAPI upload front-end with a tuned uvicorn configuration:
+# - uvloop event loop + httptools HTTP parser (~2x loop throughput over
+#   stdlib asyncio on upload-heavy workloads)
+# - one worker per CPU for parallelism on the synchronous request bits
+# - bounded concurrency and keep-alive tuning for bursty multi-file uploads
+#
+# Pipeline work itself runs on the Celery workers (see tasks.py); this
+# process only ingests uploads and serves status queries.
+
+# --- Strict Mode ---
+set -e
+set -u
+set -o pipefail
+
+APP_MODULE="${APP_MODULE:-api_server:app}"
+HOST="${API_HOST:-0.0.0.0}"
+PORT="${API_PORT:-8000}"
+WORKERS="${API_WORKERS:-$(getconf _NPROCESSORS_ONLN)}"
+
+echo "Starting ${APP_MODULE} on ${HOST}:${PORT} with ${WORKERS} worker(s)..."
+
+exec uvicorn "${APP_MODULE}" \
+    --host "${HOST}" \
+    --port "${PORT}" \
+    --loop uvloop \
+    --http httptools \
+    --workers "${WORKERS}" \
+    --limit-concurrency 200 \
+    --timeout-keep-alive 30
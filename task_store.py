@@ -0,0 +1,67 @@
+# task_store.py
+#
+# Structured pipeline task status, backed by Redis hashes. Each task records
+# which stage it is in and whether it is running, succeeded, or failed, so
+# clients poll an endpoint instead of scraping server logs — and failed tasks
+# can be re-entered at the stage that broke, reusing cached earlier outputs.
+
+import os
+import time
+import logging
+from typing import Dict, Optional
+
+import redis
+
+# Status entries outlive the pipeline run by a week, matching the stage cache.
+STATUS_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+class TaskStore:
+    """Records and serves per-stage pipeline task state."""
+
+    def __init__(self, url: str = None):
+        self._url = url or os.getenv("PIPELINE_STATUS_URL", "redis://localhost:6379/3")
+        self._client = None
+
+    def _get_client(self) -> Optional[redis.Redis]:
+        """Lazily connects to Redis; returns None if the server is unreachable."""
+        if self._client is None:
+            try:
+                self._client = redis.Redis.from_url(self._url, decode_responses=True)
+                self._client.ping()
+            except Exception as e:
+                logging.warning(f"Task store unavailable, status updates will be dropped: {e}")
+                self._client = None
+                return None
+        return self._client
+
+    def update(self, task_id: str, stage: int, status: str, error: str = None):
+        """Records the current stage and status for a task."""
+        client = self._get_client()
+        if not client:
+            return
+        mapping = {"stage": stage, "status": status, "updated_at": int(time.time())}
+        if error is not None:
+            mapping["error"] = error
+        try:
+            key = f"task-status:{task_id}"
+            client.hset(key, mapping=mapping)
+            client.expire(key, STATUS_TTL_SECONDS)
+        except Exception as e:
+            logging.warning(f"Task store update failed for {task_id}: {e}")
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """Returns the recorded state for a task, or None if unknown."""
+        client = self._get_client()
+        if not client:
+            return None
+        try:
+            state = client.hgetall(f"task-status:{task_id}")
+            return state or None
+        except Exception as e:
+            logging.warning(f"Task store read failed for {task_id}: {e}")
+            return None
+
+
+# Module-level singleton shared by the API servers and Celery workers.
+store = TaskStore()
@@ -0,0 +1,259 @@
+# tasks.py
+#
+# Celery task definitions for the document processing pipeline. Running the
+# pipeline through a Redis-backed queue means in-flight work survives API
+# server restarts and throughput scales horizontally by adding worker
+# replicas. Start workers with:
+#
+#   celery -A tasks worker --concurrency=$(nproc)
+
+import os
+import base64
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+from celery import Celery
+from celery.signals import worker_process_init
+from prometheus_client import start_http_server
+
+import cache
+from task_store import store as task_store
+
+# --- Direct imports of the core processing functions from our pipeline scripts ---
+from stage_1_processing import process_single_pdf
+from stage_2_processing import initialize_llm, process_single_document
+from stage_3_processing import initialize_markitdown_client, process_single_markdown_file
+
+# --- Centralized Pipeline Configuration ---
+BASE_DIR = Path(__file__).resolve().parent
+STAGE1_MD_DIR = BASE_DIR / "preprocessed_markdown"
+STAGE1_ASSET_DIR = BASE_DIR / "document_assets"
+STAGE2_MD_DIR = BASE_DIR / "final_markdown"
+STAGE3_OUTPUT_DIR = BASE_DIR / "markitdown_output"
+
+# Precomputed string forms of the stage directories. process_single_* and the
+# cache helpers all take strings, so the hot task paths build them with
+# f-strings instead of allocating/normalizing Path objects on every task.
+_S1_MD_STR = str(STAGE1_MD_DIR)
+_S1_ASSET_STR = str(STAGE1_ASSET_DIR)
+_S2_MD_STR = str(STAGE2_MD_DIR)
+_S3_OUT_STR = str(STAGE3_OUTPUT_DIR)
+
+# Cache version tags: bump whenever the stage prompt or deployed model changes,
+# so stale outputs are never served for a new prompt/model revision.
+STAGE2_CACHE_VERSION = f"s2-v1-{os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', 'default')}"
+STAGE3_CACHE_VERSION = f"s3-v1-{os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', 'default')}"
+
+# --- Setup Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# --- Celery Application ---
+# The broker and result backend both live in Redis so task state is durable
+# and queryable from the API via AsyncResult.
+celery_app = Celery(
+    "pipeline",
+    broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
+    backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/1"),
+)
+
+# --- Per-Worker API Clients ---
+# Clients are initialized once per worker process rather than at import time,
+# so the API server process never pays for (or depends on) worker credentials.
+llm_client = None
+md_client = None
+
+
+def _stage1_up_to_date(pdf_hash: str, base_filename: str) -> bool:
+    """
+    Returns True if Stage 1 output already exists for this exact PDF
+    content, recorded as a content hash in a manifest sidecar. Every upload
+    lands at a fresh uuid temp path whose mtime is the upload time, so only
+    the content hash can match across re-uploads of the same document (e.g.
+    a retry after a transient Stage 3 failure).
+    """
+    manifest_path = f"{_S1_MD_STR}/{base_filename}.manifest.json"
+    md_path = f"{_S1_MD_STR}/{base_filename}.md"
+    if not (os.path.exists(manifest_path) and os.path.exists(md_path)):
+        return False
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return manifest.get("pdf_hash") == pdf_hash
+    except (OSError, ValueError):
+        return False
+
+
+def _record_stage1_manifest(pdf_hash: str, base_filename: str):
+    """Records the processed PDF's content hash next to the Stage 1 output."""
+    try:
+        with open(f"{_S1_MD_STR}/{base_filename}.manifest.json", "w", encoding="utf-8") as f:
+            json.dump({"pdf_hash": pdf_hash}, f)
+    except OSError as e:
+        logging.warning(f"Could not record Stage 1 manifest for {base_filename}: {e}")
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_bytes_atomic(path: str, data: bytes):
+    """Writes to a temp file then os.replace()s it into place, so a crash
+    mid-write can never leave a half-written file for later stages to read."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# Each prefork worker process exposes its own /metrics endpoint starting at
+# this port; Prometheus scrapes the whole range. The cache hit/miss counters
+# increment in the workers, so scraping only the API server would read zeros.
+WORKER_METRICS_BASE_PORT = int(os.getenv("WORKER_METRICS_BASE_PORT", "9200"))
+WORKER_METRICS_PORT_RANGE = 64
+
+
+def _start_worker_metrics_server():
+    """Serves this worker's Prometheus registry on the first free port in the
+    configured range; skips ports claimed by sibling worker processes."""
+    for port in range(WORKER_METRICS_BASE_PORT,
+                      WORKER_METRICS_BASE_PORT + WORKER_METRICS_PORT_RANGE):
+        try:
+            start_http_server(port)
+            logging.info(f"Worker metrics exporter listening on port {port}.")
+            return
+        except OSError:
+            continue
+    logging.warning(
+        f"No free port in {WORKER_METRICS_BASE_PORT}-"
+        f"{WORKER_METRICS_BASE_PORT + WORKER_METRICS_PORT_RANGE - 1}; "
+        "worker cache metrics will not be scrapable from this process.")
+
+
+@worker_process_init.connect
+def init_worker_clients(**kwargs):
+    """Initializes the Azure API clients once per Celery worker process."""
+    global llm_client, md_client
+    _start_worker_metrics_server()
+    logging.info("Initializing API clients for worker process...")
+    llm_client = initialize_llm()
+    md_client = initialize_markitdown_client()
+    if not llm_client or not md_client:
+        logging.error("FATAL: Could not initialize one or more Azure API clients in worker. Check environment variables.")
+
+
+@celery_app.task(name="pipeline.process_pdf", bind=True)
+def process_pdf_pipeline_task(self, temp_pdf_path: str, base_filename: str):
+    """Celery task for the full 3-stage PDF processing pipeline."""
+    logging.info(f"PDF PIPELINE STARTING for document: {base_filename}")
+    task_id = self.request.id
+    stage = 0
+    try:
+        # Stage 1: Local OCR and Asset Extraction (content-hash short-circuit)
+        stage = 1
+        task_store.update(task_id, stage=1, status="running")
+        pdf_hash = cache.hash_file(temp_pdf_path)
+        if _stage1_up_to_date(pdf_hash, base_filename):
+            logging.info(f"Stage 1 SKIPPED for {base_filename} (output up to date)")
+        else:
+            # Pass the document's real name: the temp path carries a uuid
+            # suffix, so letting Stage 1 derive the basename from it would
+            # write {base}_{uuid}.md and the manifest/Stage 2 paths below
+            # would never line up with the actual output.
+            s1_result = process_single_pdf(temp_pdf_path, _S1_MD_STR, _S1_ASSET_STR,
+                                           base_filename=base_filename)
+            if s1_result["status"] != "success":
+                raise RuntimeError(f"Stage 1 failed: {s1_result.get('error', 'Unknown error')}")
+            _record_stage1_manifest(pdf_hash, base_filename)
+            logging.info(f"Stage 1 SUCCESS for {base_filename}")
+        task_store.update(task_id, stage=1, status="success")
+
+        # Stage 2: LLM Vision Analysis and Cleanup (content-hash cached)
+        stage = 2
+        task_store.update(task_id, stage=2, status="running")
+        s1_md_path = f"{_S1_MD_STR}/{base_filename}.md"
+        s1_asset_dir = f"{_S1_ASSET_STR}/{base_filename}"
+        s2_md_path = f"{_S2_MD_STR}/{base_filename}.md"
+        s2_hash = cache.hash_file(s1_md_path)
+        if cached := cache.check(s2_hash, STAGE2_CACHE_VERSION):
+            _write_bytes_atomic(s2_md_path, cached)
+            logging.info(f"Stage 2 CACHE HIT for {base_filename}")
+        else:
+            s2_result = process_single_document(llm_client, s1_md_path, s1_asset_dir, _S2_MD_STR)
+            if s2_result["status"] != "success":
+                raise RuntimeError(f"Stage 2 failed: {s2_result.get('error', 'Unknown error')}")
+            cache.save(s2_hash, STAGE2_CACHE_VERSION, _read_bytes(s2_md_path))
+            logging.info(f"Stage 2 SUCCESS for {base_filename}")
+        task_store.update(task_id, stage=2, status="success")
+
+        # Stage 3: Final Document Synthesis (content-hash cached)
+        stage = 3
+        task_store.update(task_id, stage=3, status="running")
+        s3_output_path = f"{_S3_OUT_STR}/{base_filename}.md"
+        s3_hash = cache.hash_file(s2_md_path)
+        if cached := cache.check(s3_hash, STAGE3_CACHE_VERSION):
+            _write_bytes_atomic(s3_output_path, cached)
+            logging.info(f"Stage 3 CACHE HIT for {base_filename}")
+        else:
+            s3_result = process_single_markdown_file(md_client, s2_md_path, _S3_OUT_STR)
+            if s3_result["status"] != "success":
+                raise RuntimeError(f"Stage 3 failed: {s3_result.get('error', 'Unknown error')}")
+            cache.save(s3_hash, STAGE3_CACHE_VERSION, _read_bytes(s3_output_path))
+            logging.info(f"Stage 3 SUCCESS for {base_filename}")
+        task_store.update(task_id, stage=3, status="success")
+
+    except Exception as e:
+        task_store.update(task_id, stage=stage, status="failed", error=str(e))
+        logging.error(f"PDF PIPELINE FAILED for {base_filename}: {e}", exc_info=True)
+        raise
+    finally:
+        # Single-syscall cleanup: no exists() stat before the unlink.
+        Path(temp_pdf_path).unlink(missing_ok=True)
+        logging.info(f"Cleaned up temporary file: {temp_pdf_path}")
+
+
+@celery_app.task(name="pipeline.process_text", bind=True)
+def process_text_pipeline_task(self, temp_doc_path: str, base_filename: str,
+                               content_b64: str = None, suffix: str = ".md"):
+    """
+    Celery task for the 'fast path' text-based document processing.
+
+    Small uploads arrive inline as base64 in `content_b64` instead of a path,
+    skipping the API-host temp-file round-trip; the worker spills them to a
+    local temp file only because MarkItDown's convert() is path-based.
+    """
+    logging.info(f"TEXT PIPELINE STARTING for document: {base_filename}")
+    task_id = self.request.id
+    task_store.update(task_id, stage=3, status="running")
+    try:
+        if content_b64 is not None:
+            # Stage 3 names its output after the input file's basename, so
+            # the spill file must carry the document's name — an anonymous
+            # tmpXXXXXXXX name would sever the output from the upload.
+            with tempfile.NamedTemporaryFile("wb", prefix=f"{base_filename}_",
+                                             suffix=suffix, delete=False) as tmp:
+                tmp.write(base64.b64decode(content_b64))
+                temp_doc_path = tmp.name
+        # For text files, we bypass Stages 1 and 2.
+        logging.info(f"Bypassing Stage 1 & 2 for text file: {base_filename}")
+        s3_result = process_single_markdown_file(md_client, temp_doc_path, _S3_OUT_STR)
+        if s3_result["status"] != "success":
+            raise RuntimeError(f"Stage 3 (fast path) failed: {s3_result.get('error', 'Unknown error')}")
+        logging.info(f"Stage 3 (fast path) SUCCESS for {base_filename}")
+        task_store.update(task_id, stage=3, status="success")
+
+    except Exception as e:
+        task_store.update(task_id, stage=3, status="failed", error=str(e))
+        logging.error(f"TEXT PIPELINE FAILED for {base_filename}: {e}", exc_info=True)
+        raise
+    finally:
+        # Single-syscall cleanup: no exists() stat before the unlink.
+        if temp_doc_path:
+            Path(temp_doc_path).unlink(missing_ok=True)
+            logging.info(f"Cleaned up temporary file: {temp_doc_path}")
@@ -0,0 +1,88 @@
+# test_api_server.py
+#
+# Tests for the FastAPI upload endpoint in api_server.py. These exercise the
+# save-and-route path with the Celery tasks faked out, so a regression in the
+# async file write (e.g. awaiting a synchronously-delegated aiofiles method)
+# fails here instead of on the first real upload.
+
+import pytest
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import api_server
+
+
+class _FakeTask:
+    """Stands in for a Celery task: records every delay() call."""
+
+    def __init__(self):
+        self.delay_calls = []
+
+    def delay(self, *args, **kwargs):
+        self.delay_calls.append((args, kwargs))
+        return SimpleNamespace(id=f"fake-task-{len(self.delay_calls)}")
+
+
+@pytest.fixture
+def fake_pdf_task(monkeypatch, tmp_path):
+    """Routes uploads into tmp_path and fakes the PDF pipeline task."""
+    task = _FakeTask()
+    monkeypatch.setattr(api_server, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(api_server, "process_pdf_pipeline_task", task)
+    return task
+
+
+class TestUploadSavePath:
+    """Tests for the /process upload save path."""
+
+    def test_pdf_upload_saves_file_and_queues_task(self, fake_pdf_task, tmp_path):
+        """
+        Integration Test: Posts a PDF through the endpoint and verifies the
+        bytes land on disk intact and the pipeline task is queued with the
+        saved path. PDFs always take the streaming aiofiles branch, so this
+        covers the flush/posix_fadvise epilogue as well.
+        """
+        pdf_bytes = b"%PDF-1.4\n" + b"x" * 2048
+
+        with TestClient(api_server.app) as client:
+            response = client.post(
+                "/process",
+                files=[("files", ("manual.pdf", pdf_bytes, "application/pdf"))],
+            )
+
+        assert response.status_code == 202
+        results = response.json()["results"]
+        assert len(results) == 1
+        assert results[0]["status"] == "accepted_for_pdf_pipeline", results[0]
+        assert results[0]["task_id"] == "fake-task-1"
+
+        # The task must point at a file whose contents match the upload.
+        assert len(fake_pdf_task.delay_calls) == 1
+        (saved_path, base_name), _ = fake_pdf_task.delay_calls[0]
+        assert base_name == "manual"
+        with open(saved_path, "rb") as f:
+            assert f.read() == pdf_bytes
+
+    def test_pdf_upload_exceeding_small_threshold_streams_in_chunks(
+            self, fake_pdf_task, tmp_path, monkeypatch):
+        """
+        Integration Test: Shrinks the small-upload threshold so the upload
+        spans multiple reads, exercising the chunked streaming loop rather
+        than the single head read.
+        """
+        monkeypatch.setattr(api_server, "SMALL_UPLOAD_THRESHOLD", 16)
+        pdf_bytes = b"%PDF-1.4\n" + b"y" * 256
+
+        with TestClient(api_server.app) as client:
+            response = client.post(
+                "/process",
+                files=[("files", ("large.pdf", pdf_bytes, "application/pdf"))],
+            )
+
+        assert response.status_code == 202
+        assert response.json()["results"][0]["status"] == "accepted_for_pdf_pipeline"
+
+        (saved_path, _), _ = fake_pdf_task.delay_calls[-1]
+        with open(saved_path, "rb") as f:
+            assert f.read() == pdf_bytes